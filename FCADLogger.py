@@ -1,8 +1,14 @@
-import os, inspect, sys
+import os, inspect, sys, threading
+from collections import deque
 from datetime import datetime
 import FreeCAD, FreeCADGui
 
 class FCADLogger:
+    # Messages logged by other threads, as the FreeCAD console is only safe to
+    # use in the main thread. They are printed by flushThreadLog().
+    _threadLog = deque()
+    _mainThread = threading.current_thread()
+
     def __init__(self, tag, **kargs):
         self.tag = tag
         self.levels = { 'error':0, 'warn':1, 'info':2,
@@ -17,11 +23,19 @@ class FCADLogger:
         for key,default in (('printTag',True),('noUpdateUI',True),
                 ('timing',True),('lineno',True),('parent',None)):
             setattr(self,key,kargs.get(key,default))
+        self._level = FreeCAD.getLogLevel(self.tag)
+
+    def _getLevel(self):
+        # Other threads use the level last read in the main thread, and the
+        # messages are checked again when flushed.
+        if threading.current_thread() is FCADLogger._mainThread:
+            self._level = FreeCAD.getLogLevel(self.tag)
+        return self._level
 
     def _isEnabledFor(self,level):
         if self.parent and not self.parent._isEnabledFor(level):
             return False
-        return FreeCAD.getLogLevel(self.tag) >= level
+        return self._getLevel() >= level
 
     def isEnabledFor(self,level):
         if not isinstance(level,int):
@@ -47,6 +61,31 @@ class FCADLogger:
         if not self._isEnabledFor(level):
             return
 
+        location = ''
+        if self.lineno:
+            try:
+                frame = sys._getframe(frame+1)
+                location = '{}({}): '.format(os.path.basename(
+                    frame.f_code.co_filename),frame.f_lineno)
+            except Exception:
+                frame = inspect.stack()[frame+1]
+                location = '{}({}): '.format(
+                        os.path.basename(frame[1]),frame[2])
+
+        if threading.current_thread() is not FCADLogger._mainThread:
+            FCADLogger._threadLog.append((self,level,location,msg))
+            return
+        self._print(level,location,msg)
+
+    @classmethod
+    def flushThreadLog(cls):
+        'Print the messages logged by other threads. Main thread only.'
+        while cls._threadLog:
+            logger,level,location,msg = cls._threadLog.popleft()
+            if logger._isEnabledFor(level):
+                logger._print(level,location,msg)
+
+    def _print(self,level,location,msg):
         prefix = ''
 
         if self.printTag:
@@ -57,16 +96,7 @@ class FCADLogger:
             prefix += '{} - '.format((now-self.laststamp).total_seconds())
             self.laststamp = now
 
-        if self.lineno:
-            try:
-                frame = sys._getframe(frame+1)
-                prefix += '{}({}): '.format(os.path.basename(
-                    frame.f_code.co_filename),frame.f_lineno)
-            except Exception:
-                frame = inspect.stack()[frame+1]
-                prefix += '{}({}): '.format(os.path.basename(frame[1]),frame[2])
-
-        self.printer[level]('{}{}\n'.format(prefix,msg))
+        self.printer[level]('{}{}{}\n'.format(prefix,location,msg))
 
         if not self.noUpdateUI:
             try:
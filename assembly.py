@@ -1,4 +1,4 @@
-import os
+import os, weakref
 from collections import namedtuple,defaultdict
 import FreeCAD, FreeCADGui, Part
 from PySide import QtCore, QtGui
@@ -227,6 +227,8 @@ class AsmPartGroup(AsmGroup):
     def onChanged(self,obj,prop):
         if obj.Removing or FreeCAD.isRestoring():
             return
+        if prop in ('DerivedFrom','Group'):
+            Assembly.invalidateFixedParts()
         if prop == 'DerivedFrom':
             self.checkDerivedParts()
         elif prop == 'Group':
@@ -347,7 +349,7 @@ class AsmElement(AsmBase):
             parent.Object.cacheChildLabel()
         if prop not in _IgnoredProperties and \
            not Constraint.isDisabled(parent.Object):
-            Assembly.autoSolve(obj,prop)
+            Assembly.autoSolve(obj,prop,assembly=self.getAssembly())
 
     def execute(self,obj):
         info = None
@@ -957,10 +959,20 @@ class AsmElementLink(AsmBase):
 
     def execute(self,_obj):
         info = self.getInfo(True)
+        # only invalidate the constraint's solver key if the linked element
+        # changed, see solver._getConstraintKey()
+        key = (info.Part,info.Subname,utils.getShapeKey(info.Shape))
+        if getattr(self,'elementKey',None) != key:
+            self.elementKey = key
+            self.parent.dirty = True
+        oldPart = self.part
+        if oldPart == info.Part:
+            return False
+        self.part = info.Part
+        Assembly.invalidateFixedParts()
+        self.getAssembly().invalidatePartConstraints()
         relationGroup = self.getAssembly().getRelationGroup()
-        if relationGroup and (not self.part or self.part!=info.Part):
-            oldPart = self.part
-            self.part = info.Part
+        if relationGroup:
             relationGroup.Proxy.update(
                     self.parent.Object,oldPart,info.Part,info.PartName)
         return False
@@ -973,6 +985,9 @@ class AsmElementLink(AsmBase):
            not getattr(self,'parent',None) or \
            FreeCAD.isRestoring():
             return
+        if prop not in self._MyIgnoredProperties:
+            self.parent.dirty = True
+            Assembly.invalidateFixedParts()
         if prop == 'Count':
             self.infos *= 0 # clear the list
             self.info = None
@@ -988,7 +1003,7 @@ class AsmElementLink(AsmBase):
             return
         if prop not in self._MyIgnoredProperties and \
            not Constraint.isDisabled(self.parent.Object):
-            Assembly.autoSolve(obj,prop)
+            Assembly.autoSolve(obj,prop,assembly=self.getAssembly())
 
     def getAssembly(self):
         return self.parent.parent.parent
@@ -1208,6 +1223,21 @@ class AsmElementLink(AsmBase):
 
         return self.infos if expand else self.info
 
+    @staticmethod
+    def getPlacement(part):
+        '''
+        return the current placement of a part
+
+        part: obtained by AsmConstraint.getInfo().Part
+        '''
+        if isinstance(part,tuple):
+            if part[3]:
+                pla = getLinkProperty(part[0],'PlacementList')[part[1]]
+            else:
+                pla = part[2].Placement
+            return part[0].Placement.multiply(pla)
+        return part.Placement
+
     @staticmethod
     def setPlacement(part,pla):
         '''
@@ -1243,6 +1273,9 @@ class AsmElementLink(AsmBase):
 def setPlacement(part,pla):
     AsmElementLink.setPlacement(part,pla)
 
+def getPlacement(part):
+    return AsmElementLink.getPlacement(part)
+
 
 class ViewProviderAsmElementLink(ViewProviderAsmOnTop):
     def __init__(self,vobj):
@@ -1289,6 +1322,9 @@ class AsmConstraint(AsmGroup):
     def __init__(self,parent):
         self._initializing = True
         self.elements = None
+        # whether the constraint or its elements changed since last checked by
+        # the solver, see solver._getConstraintKey()
+        self.dirty = True
         self.parent = getProxy(parent,AsmConstraintGroup)
         super(AsmConstraint,self).__init__()
 
@@ -1320,13 +1356,23 @@ class AsmConstraint(AsmGroup):
 
     def onChanged(self,obj,prop):
         if not obj.Removing and prop not in _IgnoredProperties:
+            self.dirty = True
+            Assembly.invalidateFixedParts()
+            if prop == 'Group' and getattr(self,'parent',None) and \
+                    not FreeCAD.isRestoring():
+                self.getAssembly().invalidatePartConstraints()
             if prop == Constraint.propMultiply() and not FreeCAD.isRestoring():
                 self.checkMultiply()
             Constraint.onChanged(obj,prop)
-            Assembly.autoSolve(obj,prop)
+            # parent is not set yet while restoring
+            assembly = None
+            if getattr(self,'parent',None):
+                assembly = self.getAssembly()
+            Assembly.autoSolve(obj,prop,assembly=assembly)
 
     def linkSetup(self,obj):
         self.elements = None
+        self.dirty = True
         super(AsmConstraint,self).linkSetup(obj)
         group = obj.Group
         for o in group:
@@ -1428,8 +1474,9 @@ class AsmConstraint(AsmGroup):
                     continue
                 elementInfo += info
                 elements.append(o)
+            cache = self.getAssembly().elementCheckCache
             for info in zip(firstInfo,elementInfo[:len(firstInfo)]):
-                Constraint.check(obj,info,True)
+                Constraint.check(obj,info,True,cache)
         else:
             for o in group:
                 checkType(o,AsmElementLink)
@@ -1438,7 +1485,8 @@ class AsmConstraint(AsmGroup):
                     return
                 elementInfo.append(info)
                 elements.append(o)
-            Constraint.check(obj,elementInfo,True)
+            Constraint.check(obj,elementInfo,True,
+                    self.getAssembly().elementCheckCache)
         self.elements = elements
         return self.elements
 
@@ -1775,8 +1823,11 @@ class AsmConstraintGroup(AsmGroup):
         if obj.Removing or FreeCAD.isRestoring():
             return
         if prop not in _IgnoredProperties:
+            Assembly.invalidateFixedParts()
+            if prop == 'Group':
+                self.parent.invalidatePartConstraints()
             System.onChanged(obj,prop)
-            Assembly.autoSolve(obj,prop)
+            Assembly.autoSolve(obj,prop,assembly=self.parent)
 
     @staticmethod
     def make(parent,name='Constraints'):
@@ -1948,7 +1999,9 @@ class AsmRelationGroup(AsmBase):
             o = relations.get(part,None)
             if not o:
                 touched = True
-                new.append(AsmRelation.make(obj,part))
+                # only relations of link arrays need to compute their children
+                new.append(AsmRelation.make(obj,part,
+                    recompute=getLinkProperty(part,'ElementCount',0)>0))
                 group.append(new[-1])
                 self.relations[part] = new[-1]
             else:
@@ -2176,9 +2229,11 @@ class AsmRelation(AsmBase):
             obj.Count = count
             self.getConstraints()
         elif obj.Count < count:
+            # Relations of array elements have nothing to compute, so there is
+            # no need to recompute them one by one
             new = []
             for i in xrange(obj.Count,count):
-                new.append(AsmRelation.make(obj,(part,i)))
+                new.append(AsmRelation.make(obj,(part,i),recompute=False))
             obj.Count = count
             obj.Group = obj.Group[:obj.Count]+new
             for o in new:
@@ -2253,22 +2308,11 @@ class AsmRelation(AsmBase):
             part = (obj.Part,obj.Index)
         else:
             part = obj.Part
-        group = []
-        for cstr in self.getAssembly().getConstraintGroup().Group:
-            for element in cstr.Group:
-                info = element.Proxy.getInfo()
-                if isinstance(info.Part,tuple):
-                    infoPart = info.Part[:2]
-                else:
-                    infoPart = info.Part
-                if infoPart==part:
-                    group.append(cstr)
-                    break
-        obj.Group = group
+        obj.Group = self.getAssembly().getPartConstraints(part)
         obj.purgeTouched()
 
     @staticmethod
-    def make(parent,part,name='Relation'):
+    def make(parent,part,name='Relation',recompute=True):
         obj = parent.Document.addObject("App::FeaturePython",name,
                     AsmRelation(parent),None,True)
         ViewProviderAsmRelation(obj.ViewObject)
@@ -2279,7 +2323,8 @@ class AsmRelation(AsmBase):
         else:
             obj.setLink(part)
             obj.Label = part.Label
-        obj.recompute()
+        if recompute:
+            obj.recompute()
         obj.setPropertyStatus('Index','Immutable')
         obj.purgeTouched()
         return obj
@@ -2311,20 +2356,104 @@ BuildShapeNames = (BuildShapeNone,BuildShapeCompound,
 class Assembly(AsmGroup):
     _Timer = QtCore.QTimer()
     _TransID = 0
-    _PartMap = {} # maps part to assembly
-    _PartArrayMap = {} # maps array part to assembly
+    # Maps part to the assemblies constraining it, which may come from multiple
+    # documents. Entries are removed when the assembly or the part is deleted,
+    # see onDeletedObject() and onDeleteDocument().
+    _PartMap = defaultdict(weakref.WeakSet)
+    # maps array part to the assemblies constraining its elements
+    _PartArrayMap = defaultdict(weakref.WeakSet)
     _ScheduleTimer = QtCore.QTimer()
     _PendingRemove = []
     _PendingReload = defaultdict(set)
+    # bumped on any change that may affect the fixed parts of an assembly
+    _FixedPartsRevision = 0
+    # assemblies changed since the last auto solve, and whether there is any
+    # change not known to belong to one
+    _AutoSolveSet = set()
+    _AutoSolveAll = False
+    # auto solve delay in ms as (minimum, default, maximum), with the delay
+    # being _AutoSolveFactor times the averaged solving time of the changed
+    # assemblies
+    _AutoSolveDelay = (50,300,2000)
+    _AutoSolveFactor = 2.0
+    # smoothing factor of the averaged solving time
+    _SolveTimeFactor = 0.3
 
     def __init__(self):
         self.parts = set()
         self.partArrays = set()
         self.constraints = None
+        # element geometry cache of the solver, see Solver.getGeometry()
+        self.geometryCache = {}
+        # (parts,characteristic length) of the solver, see Solver._prepare()
+        self.scaleCache = None
+        # (entity def,part,subname) -> (shape,validation message) of
+        # constraint elements, pruned by the solver, see Constraint.check()
+        self.elementCheckCache = {}
+        # see Constraint.getFixedParts()
+        self.fixedPartsCache = {}
+        # see getPartConstraints()
+        self.partConstraintMap = None
+        # averaged solving time in seconds, see updateSolveTime()
+        self.solveTime = None
         self.frozen = False
         self.deleting = False
         super(Assembly,self).__init__()
 
+    @classmethod
+    def invalidateFixedParts(cls):
+        cls._FixedPartsRevision += 1
+
+    def getFixedPartsCache(self,name,cstrs,func):
+        '''
+        Return the cached result of func(), which finds the fixed parts of this
+        assembly with the given constraints
+        '''
+        key = (Assembly._FixedPartsRevision,tuple(cstrs))
+        entry = self.fixedPartsCache.get(name,None)
+        if entry and entry[0]==key:
+            return entry[1]
+        ret = func()
+        self.fixedPartsCache[name] = (key,ret)
+        return ret
+
+    def updateSolveTime(self,elapsed):
+        if getattr(self,'solveTime',None) is None:
+            self.solveTime = elapsed
+        else:
+            self.solveTime += Assembly._SolveTimeFactor*(elapsed-self.solveTime)
+
+    def invalidatePartConstraints(self):
+        self.partConstraintMap = None
+
+    def getPartConstraints(self,part):
+        '''
+        Return the constraints referring to the given part, or (array, index)
+        of an array element, in the order of the constraint group
+        '''
+        return list(self._getPartConstraintMap().get(part,()))
+
+    def getConstrainedParts(self):
+        'Return the parts referred by any constraint'
+        return list(self._getPartConstraintMap())
+
+    def _getPartConstraintMap(self):
+        partMap = getattr(self,'partConstraintMap',None)
+        if partMap is None:
+            partMap = {}
+            for cstr in self.getConstraintGroup().Group:
+                for element in cstr.Group:
+                    info = element.Proxy.getInfo()
+                    if isinstance(info.Part,tuple):
+                        key = info.Part[:2]
+                    else:
+                        key = info.Part
+                    cstrs = partMap.setdefault(key,[])
+                    if not cstrs or cstrs[-1]!=cstr:
+                        cstrs.append(cstr)
+            self.partConstraintMap = partMap
+        return partMap
+
     def getSubObjects(self,_obj,reason):
         # Deletion order problem may cause exception here. Just silence it
         try:
@@ -2339,10 +2468,98 @@ class Assembly(AsmGroup):
             try:
                 oldParts.remove(part)
             except KeyError:
-                partMap[part] = self
+                partMap[part].add(self)
         for part in oldParts:
+            self._releasePart(partMap,part)
+
+    def _releasePart(self,partMap,part):
+        owners = partMap.get(part,None)
+        if owners is None:
+            return
+        owners.discard(self)
+        if not owners:
             del partMap[part]
 
+    def releaseParts(self):
+        'remove this assembly from the part index'
+        for part in self.parts:
+            self._releasePart(Assembly._PartMap,part)
+        for part in self.partArrays:
+            self._releasePart(Assembly._PartArrayMap,part)
+        self.parts = set()
+        self.partArrays = set()
+
+    @classmethod
+    def onDeletedObject(cls,obj):
+        if isTypeOf(obj,Assembly):
+            obj.Proxy.releaseParts()
+            return
+        for partMap,attr in ((cls._PartMap,'parts'),
+                (cls._PartArrayMap,'partArrays')):
+            for owner in partMap.pop(obj,()):
+                getattr(owner,attr).discard(obj)
+
+    @classmethod
+    def onDeleteDocument(cls,doc):
+        name = doc.Name
+        def inDoc(obj):
+            try:
+                return obj.Document.Name == name
+            except Exception:
+                # deleted object
+                return True
+        for partMap,attr in ((cls._PartMap,'parts'),
+                (cls._PartArrayMap,'partArrays')):
+            for part,owners in list(partMap.items()):
+                if not inDoc(part):
+                    for owner in list(owners):
+                        if inDoc(owner.Object):
+                            owners.discard(owner)
+                    if owners:
+                        continue
+                else:
+                    # including the owners in other documents
+                    for owner in owners:
+                        getattr(owner,attr).discard(part)
+                del partMap[part]
+
+    @classmethod
+    def checkPartIndex(cls):
+        '''
+        Check the part index used for auto solving against the parts of all
+        assemblies in all documents. Return a list of error messages, which is
+        empty if the index is consistent.
+        '''
+        errors = []
+        proxies = set()
+        for doc in FreeCAD.listDocuments().values():
+            for obj in doc.Objects:
+                if not isTypeOf(obj,Assembly):
+                    continue
+                proxy = obj.Proxy
+                proxies.add(proxy)
+                for parts,partMap in ((proxy.parts,cls._PartMap),
+                        (proxy.partArrays,cls._PartArrayMap)):
+                    for part in parts:
+                        if proxy not in partMap.get(part,()):
+                            errors.append('{} missing owner {}'.format(
+                                objName(part),objName(obj)))
+        for partMap,attr in ((cls._PartMap,'parts'),
+                (cls._PartArrayMap,'partArrays')):
+            for part,owners in partMap.items():
+                if not owners:
+                    errors.append('{} has no owner'.format(objName(part)))
+                for owner in owners:
+                    if owner not in proxies:
+                        errors.append('{} has stale owner'.format(
+                            objName(part)))
+                    elif part not in getattr(owner,attr):
+                        errors.append('{} has wrong owner {}'.format(
+                            objName(part),objName(owner.Object)))
+        for msg in errors:
+            logger.error('part index: {}'.format(msg))
+        return errors
+
     def execute(self,obj):
         if self.frozen:
             return True
@@ -2393,47 +2610,135 @@ class Assembly(AsmGroup):
     @classmethod
     def checkPartChange(cls, obj, prop):
         if prop == 'Label':
-            try:
-                cls._PartMap.get(obj).getRelationGroup().\
-                    Proxy.findRelation(obj).\
-                    Proxy.updateLabel()
-            except Exception:
-                pass
+            for assembly in list(cls._PartMap.get(obj,())):
+                try:
+                    assembly.getRelationGroup().\
+                        Proxy.findRelation(obj).\
+                        Proxy.updateLabel()
+                except Exception:
+                    pass
             return
 
         if not cls.canAutoSolve() or prop in _IgnoredProperties:
             return
-        assembly = None
+        owners = None
         if prop == 'Placement':
-            partMap = cls._PartMap
-            assembly = partMap.get(obj,None)
+            owners = cls._PartMap.get(obj,None)
         elif prop == 'PlacementList':
-            partMap = cls._PartArrayMap
-            assembly = partMap.get(obj,None)
-        if assembly:
-            try:
-                # This will fail if assembly got deleted
-                assembly.Object.Name
-            except Exception:
-                del partMap[obj]
-            else:
-                cls.autoSolve(obj,prop,True)
+            owners = cls._PartArrayMap.get(obj,None)
+        if owners:
+            for assembly in list(owners):
+                cls.autoSolve(obj,prop,True,assembly)
 
     @classmethod
-    def autoSolve(cls,obj,prop,force=False):
+    def autoSolve(cls,obj,prop,force=False,assembly=None):
         if force or cls.canAutoSolve():
             if not cls._Timer.isSingleShot():
                 cls._Timer.setSingleShot(True)
                 cls._Timer.timeout.connect(Assembly.onSolverTimer)
             cls._TransID = FreeCAD.getActiveTransaction()
-            logger.debug('auto solve scheduled on change of {}.{}'.format(
-                objName(obj),prop),frame=1)
-            cls._Timer.start(300)
+            if assembly:
+                cls._AutoSolveSet.add(assembly)
+            else:
+                cls._AutoSolveAll = True
+            delay = cls.getAutoSolveDelay()
+            logger.debug('auto solve scheduled in {}ms on change of '
+                '{}.{}'.format(delay,objName(obj),prop),frame=1)
+            # the result of any background solving is now outdated
+            from . import solver
+            solver.cancelAsync()
+            cls._Timer.start(delay)
+
+    @classmethod
+    def getAutoSolveDelay(cls):
+        '''
+        Return the auto solve delay scaled by the solving time of the changed
+        assemblies, so that small ones respond quickly, while big ones wait
+        for the user to finish editing
+        '''
+        minDelay,delay,maxDelay = cls._AutoSolveDelay
+        if cls._AutoSolveAll or not cls._AutoSolveSet:
+            return delay
+        solveTime = 0.0
+        for assembly in cls._AutoSolveSet:
+            t = getattr(assembly,'solveTime',None)
+            if t is None:
+                return delay
+            solveTime = max(solveTime,t)
+        delay = int(solveTime*1000*cls._AutoSolveFactor)
+        return min(maxDelay,max(minDelay,delay))
+
+    @staticmethod
+    def findParentAssemblies(obj):
+        '''
+        Return the nearest assemblies depending on the given object, without
+        going past them
+        '''
+        ret = []
+        visited = set([obj])
+        stack = list(obj.InList)
+        while stack:
+            o = stack.pop()
+            if o in visited:
+                continue
+            visited.add(o)
+            if isTypeOf(o,Assembly):
+                ret.append(o)
+            else:
+                stack += o.InList
+        return ret
+
+    @classmethod
+    def getAutoSolveObjects(cls):
+        '''
+        Return the changed assemblies and their parents in the order of
+        solving, and whether their dependencies need to be searched for more
+        assemblies to solve. Reset the change record.
+        '''
+        assemblies = cls._AutoSolveSet
+        solveAll = cls._AutoSolveAll
+        cls._AutoSolveSet = set()
+        cls._AutoSolveAll = False
+        if solveAll or not assemblies:
+            return FreeCAD.ActiveDocument.Objects,True
+
+        parentMap = {}
+        objs = []
+        for assembly in assemblies:
+            try:
+                # This will fail if assembly got deleted
+                obj = assembly.Object
+                obj.Name
+            except Exception:
+                continue
+            objs.append(obj)
+        for obj in objs:
+            if obj in parentMap:
+                continue
+            parentMap[obj] = parents = cls.findParentAssemblies(obj)
+            objs += parents
+
+        # depth first post order, i.e. parents before children, reversed
+        order = []
+        visited = set()
+        def visit(obj):
+            if obj in visited:
+                return
+            visited.add(obj)
+            for parent in parentMap[obj]:
+                visit(parent)
+            order.append(obj)
+        for obj in objs:
+            visit(obj)
+        order.reverse()
+        return order,False
 
     @classmethod
     def cancelAutoSolve(cls):
         logger.debug('cancel auto solve',frame=1)
         cls._Timer.stop()
+        from . import solver
+        solver.cancelAsync()
 
     @classmethod
     def onSolverTimer(cls):
@@ -2443,14 +2748,11 @@ class Assembly(AsmGroup):
         trans = cls._TransID and cls._TransID==FreeCAD.getActiveTransaction()
         if not trans:
             cls._TransID = 0
-            FreeCAD.setActiveTransaction('Assembly auto recompute')
-        if not logger.catch('solver exception when auto recompute',
-                solver.solve, FreeCAD.ActiveDocument.Objects, True):
-            if not trans:
-                FreeCAD.closeActiveTransaction(True)
-        else:
-            if not trans:
-                FreeCAD.closeActiveTransaction()
+        # The system is solved in background, and the result is applied in
+        # the transaction of the change if it is still active by then.
+        objs,recursive = cls.getAutoSolveObjects()
+        logger.catch('solver exception when auto recompute',
+                solver.solveAsync, objs, recursive, cls._TransID)
 
     @classmethod
     def scheduleDelete(cls,doc,names):
@@ -2630,6 +2932,11 @@ class Assembly(AsmGroup):
     def linkSetup(self,obj):
         self.parts = set()
         self.partArrays = set()
+        self.geometryCache = {}
+        self.scaleCache = None
+        self.elementCheckCache = {}
+        self.fixedPartsCache = {}
+        self.partConstraintMap = None
         obj.configLinkProperty('Placement')
         if not hasattr(obj,'ColoredElements'):
             obj.addProperty("App::PropertyLinkSubHidden",
@@ -2685,7 +2992,7 @@ class Assembly(AsmGroup):
             return
         if prop!='Group' and prop not in _IgnoredProperties:
             System.onChanged(obj,prop)
-            Assembly.autoSolve(obj,prop)
+            Assembly.autoSolve(obj,prop,assembly=self)
 
     def getConstraintGroup(self, create=False):
         obj = self.Object
@@ -3023,11 +3330,15 @@ class ViewProviderAssembly(ViewProviderAsmGroup):
         FreeCADGui.Selection.clearSelection()
         self.__class__._Busy = True
         FreeCAD.setActiveTransaction('Assembly move')
+        if getattr(self,'_movingPart',None):
+            self._movingPart.onDragStart()
 
     def onDragMotion(self):
-        return self._movingPart.move()
+        return self._movingPart.onDragMotion()
 
     def onDragEnd(self):
+        if getattr(self,'_movingPart',None):
+            self._movingPart.end()
         self.__class__._Busy = False
         FreeCAD.closeActiveTransaction()
 
@@ -3089,6 +3400,10 @@ class AsmWorkPlane(object):
             obj.Shape = Part.makePlane(length,width,
                     FreeCAD.Vector(-length/2,-width/2,0))
 
+    def onChanged(self,_obj,prop):
+        if prop == 'Fixed':
+            Assembly.invalidateFixedParts()
+
     def __getstate__(self):
         return
 
@@ -56,7 +56,7 @@ def _p(solver,partInfo,subname,shape,retAll=False):
         system.log('cache {}: {}'.format(key,h))
         return h if retAll else h.entity
 
-    v = utils.getElementPos(shape)
+    v = solver.getGeometry(part,subname,shape,'pos',utils.getElementPos)
 
     if utils.isDraftWire(part):
         nameTag = partInfo.PartName + '.' + key
@@ -121,7 +121,8 @@ def _n(solver,partInfo,subname,shape,retAll=False):
         if utils.isDraftCircle(partInfo.Part):
             _prepareDraftCircle(solver,partInfo)
 
-        rot = utils.getElementRotation(shape)
+        rot = solver.getGeometry(partInfo.Part,subname,shape,'rot',
+                utils.getElementRotation)
         nameTag = partInfo.PartName + '.' + key
         system.NameTag = nameTag
         e = system.addNormal3dV(*utils.getNormal(rot))
@@ -154,6 +155,10 @@ def _n(solver,partInfo,subname,shape,retAll=False):
         partInfo.EntityMap[key] = h
     return h if retAll else h.entity
 
+def _getEndPoints(shape):
+    v = shape.Edge1.Vertexes
+    return v[0].Point,v[-1].Point
+
 def _l(solver,partInfo,subname,shape,retAll=False):
     'return a pair of handle of the end points of an edge in "shape"'
     if not solver:
@@ -189,13 +194,13 @@ def _l(solver,partInfo,subname,shape,retAll=False):
             tp0 = _p(solver,partInfo,vname1,v[0])
             tp1 = _p(solver,partInfo,vname2,v[1])
         else:
-            v = shape.Edge1.Vertexes
+            v = solver.getGeometry(part,subname,shape,'ends',_getEndPoints)
             system.NameTag = nameTag + 'p0'
-            p0 = system.addPoint3dV(*v[0].Point)
+            p0 = system.addPoint3dV(*v[0])
             system.NameTag = nameTag + 'p0t'
             tp0 = system.addTransform(p0,*partInfo.Params,group=partInfo.Group)
             system.NameTag = nameTag + 'p1'
-            p1 = system.addPoint3dV(*v[-1].Point)
+            p1 = system.addPoint3dV(*v[1])
             system.NameTag = nameTag + 'p1t'
             tp1 = system.addTransform(p1,*partInfo.Params,group=partInfo.Group)
 
@@ -344,7 +349,8 @@ def _c(solver,partInfo,subname,shape,requireArc=False,retAll=False):
             partInfo.EntityMap[sub] = h
     else:
         pln = _w(solver,partInfo,subname,shape,True)
-        r = utils.getElementCircular(shape)
+        r = solver.getGeometry(partInfo.Part,subname,shape,'circular',
+                utils.getElementCircular)
         if not r:
             raise RuntimeError('shape is not cicular')
         system.NameTag = nameTag + '.r'
@@ -378,6 +384,22 @@ def _a(solver,partInfo,subname,shape,retAll=False):
     'return a handle of a transformed arc derived from "shape"'
     return _c(solver,partInfo,subname,shape,True,retAll)
 
+def _checkElement(entityDef,info,cache):
+    '''
+    Return the validation message of an element by an entity def function. The
+    result is kept in the optional cache as long as the element shape stays the
+    same, see Assembly.elementCheckCache
+    '''
+    if cache is None:
+        return entityDef(None,info.Part,info.Subname,info.Shape)
+    key = (entityDef,info.Part,info.Subname)
+    entry = cache.get(key,None)
+    if entry and entry[0].isSame(info.Shape):
+        return entry[1]
+    msg = entityDef(None,info.Part,info.Subname,info.Shape)
+    cache[key] = (info.Shape,msg)
+    return msg
+
 
 class ConstraintCommand:
     _menuGroupName = None
@@ -480,16 +502,67 @@ class Constraint(ProxyType):
         return setattr(obj,mcs._disabled,True)
 
     @classmethod
-    def check(mcs,tp,elements,checkCount=False):
-        mcs.getType(tp).check(elements,checkCount)
+    def check(mcs,tp,elements,checkCount=False,cache=None):
+        mcs.getType(tp).check(elements,checkCount,cache)
 
     @classmethod
     def prepare(mcs,obj,solver):
         return mcs.getProxy(obj).prepare(obj,solver)
 
+    @classmethod
+    def getRigidPairs(mcs,obj,solver):
+        return mcs.getProxy(obj).getRigidPairs(obj,solver)
+
+    @classmethod
+    def isRigid(mcs,obj):
+        return mcs.getProxy(obj).isRigid(obj)
+
+    @classmethod
+    def getFuncName(mcs,name):
+        '''
+        Return the name of the system function the constraint type is prepared
+        with, or None if it does not depend on any
+        '''
+        try:
+            return mcs.getType(name).getFuncName()
+        except KeyError:
+            return
+
+    @classmethod
+    def findFixedParts(mcs,cstrs,partGroup):
+        '''
+        Return the set of fixed parts, whether any part is explicitly fixed,
+        and the element info of the first constrained part, which is to be
+        fixed if not.
+        '''
+        # Only the first element is cached, as its info holds the current
+        # placement and shape, which do not invalidate the cache
+        ret,found,element = partGroup.Proxy.getAssembly().getFixedPartsCache(
+                'parts',cstrs,lambda:mcs._findFixedParts(cstrs,partGroup))
+        firstInfo = element.Proxy.getInfo() if element else None
+        return ret,found,firstInfo
+
     @classmethod
     def getFixedParts(mcs,solver,cstrs,partGroup):
-        firstInfo = None
+        ret,found,firstInfo = mcs.findFixedParts(cstrs,partGroup)
+        ret = set(ret)
+        if not found:
+            if not firstInfo or not solver:
+                logger.warn('no fixed part')
+                return ret
+            if utils.isDraftObject(firstInfo.Part):
+                Locked.lockElement(firstInfo,solver)
+                logger.debug('lock first draft object {}'.format(
+                    firstInfo.PartName))
+                solver.getPartInfo(firstInfo,True,solver.group)
+            else:
+                logger.debug('lock first part {}'.format(firstInfo.PartName))
+                ret.add(firstInfo.Part)
+        return ret
+
+    @classmethod
+    def _findFixedParts(mcs,cstrs,partGroup):
+        firstElement = None
         if partGroup.Proxy.derivedParts:
             ret = set(partGroup.Proxy.derivedParts)
         else:
@@ -508,27 +581,14 @@ class Constraint(ProxyType):
             cstr = mcs.getProxy(obj)
             if cstr.hasFixedPart(obj):
                 found = True
-                for info in cstr.getFixedParts(solver,obj):
+                for info in cstr.getFixedParts(None,obj):
                     logger.debug('fixed part ' + info.PartName)
                     ret.add(info.Part)
 
-            if not found and not firstInfo:
+            if not found and not firstElement:
                 elements = obj.Proxy.getElements()
                 if elements:
-                    firstInfo = elements[0].Proxy.getInfo()
-
-        if not found:
-            if not firstInfo or not solver:
-                logger.warn('no fixed part')
-                return ret
-            if utils.isDraftObject(firstInfo.Part):
-                Locked.lockElement(firstInfo,solver)
-                logger.debug('lock first draft object {}'.format(
-                    firstInfo.PartName))
-                solver.getPartInfo(firstInfo,True,solver.group)
-            else:
-                logger.debug('lock first part {}'.format(firstInfo.PartName))
-                ret.add(firstInfo.Part)
+                    firstElement = elements[0]
 
         if logger.isEnabledFor('debug'):
             logger.debug('found fixed parts:')
@@ -537,28 +597,45 @@ class Constraint(ProxyType):
                     logger.debug('\t{}.{}'.format(o[0].Name,o[1]))
                 else:
                     logger.debug('\t{}'.format(o.Name))
+        return ret,found,firstElement
+
+    @classmethod
+    def getFixedTransform(mcs,cstrs,assembly=None):
+        # Only the fixing constraints are cached, as the transform holds the
+        # current element shape, which does not invalidate the cache
+        if assembly:
+            fixed,firstPart = assembly.getFixedPartsCache('transform',cstrs,
+                    lambda:mcs._findFixedTransform(cstrs))
+        else:
+            fixed,firstPart = mcs._findFixedTransform(cstrs)
+        ret = {}
+        for obj in fixed:
+            for info in mcs.getProxy(obj).getFixedTransform(obj):
+                ret[info.Part] = info
+        if firstPart:
+            ret[firstPart] = False
         return ret
 
     @classmethod
-    def getFixedTransform(mcs,cstrs):
+    def _findFixedTransform(mcs,cstrs):
+        fixed = []
         firstPart = None
         found = False
-        ret = {}
         for obj in cstrs:
             cstr = mcs.getProxy(obj)
             if cstr.hasFixedPart(obj):
-                for info in cstr.getFixedTransform(obj):
+                fixed.append(obj)
+                if not found and cstr.getFixedTransform(obj):
                     found = True
-                    ret[info.Part] = info
 
             if not found and not firstPart:
                 elements = obj.Proxy.getElements()
                 if elements:
                     info = elements[0].Proxy.getInfo()
                     firstPart = info.Part
-        if not found and firstPart and not utils.isDraftObject(firstPart):
-            ret[firstPart] = False
-        return ret
+        if found or (firstPart and utils.isDraftObject(firstPart)):
+            firstPart = None
+        return fixed,firstPart
 
     @classmethod
     def getIcon(mcs,obj):
@@ -653,11 +730,15 @@ class Base(with_metaclass(Constraint, object)):
     def getPropertyInfoList(cls):
         return cls._props
 
+    @classmethod
+    def getFuncName(cls):
+        return getattr(cls,'_cstrFuncName','add'+cls.getName())
+
     @classmethod
     def constraintFunc(cls,obj,solver,name=None):
         try:
             if not name:
-                name = getattr(cls,'_cstrFuncName','add'+cls.getName())
+                name = cls.getFuncName()
             return getattr(solver.system,name)
         except AttributeError:
             logger.warn('{} not supported in solver "{}"'.format(
@@ -684,11 +765,11 @@ class Base(with_metaclass(Constraint, object)):
             'only {}'.format(name,len(entities)))
 
     @classmethod
-    def check(cls,elements,checkCount=False):
+    def check(cls,elements,checkCount=False,cache=None):
         entities = cls.getEntityDef(elements,checkCount)
         for i,e in enumerate(entities):
             info = elements[i]
-            msg = e(None,info.Part,info.Subname,info.Shape)
+            msg = _checkElement(e,info,cache)
             if not msg:
                 continue
             if i == len(cls._entityDef):
@@ -738,6 +819,21 @@ class Base(with_metaclass(Constraint, object)):
     def hasFixedPart(cls,_obj):
         return False
 
+    @classmethod
+    def isRigid(cls,_obj):
+        'Whether the constraint leaves no freedom between the constrained parts'
+        return False
+
+    @classmethod
+    def getRigidPairs(cls,_obj,_solver):
+        '''
+        Return a list of (info1,info2,offset) if the constraint only rigidly
+        connects pairs of parts, with the first element placement being the
+        second one's multiplied by the offset. Or None if the constraint can
+        not be solved in closed form.
+        '''
+        return
+
     @classmethod
     def getMenuText(cls):
         return cls._menuText.format(cls.getName())
@@ -869,6 +965,10 @@ class Locked(Base):
 
         return ret
 
+    @classmethod
+    def getFuncName(cls):
+        return
+
     @classmethod
     def prepare(cls,obj,solver):
         ret = []
@@ -877,7 +977,7 @@ class Locked(Base):
         return ret
 
     @classmethod
-    def check(cls,elements,_checkCount=False):
+    def check(cls,elements,_checkCount=False,_cache=None):
         if not all([utils.isElement(info.Shape) for info in elements]):
             raise RuntimeError('Constraint "{}" requires all children to be '
                     'of element (Vertex, Edge or Face)'.format(cls.getName()))
@@ -893,14 +993,14 @@ class BaseMulti(Base):
         assert(len(cls._entityDef)<=2)
 
     @classmethod
-    def check(cls,elements,checkCount=False):
+    def check(cls,elements,checkCount=False,cache=None):
         if checkCount and len(elements)<2:
             raise RuntimeError('Constraint "{}" requires at least two '
                 'elements'.format(cls.getName()))
         count = min(len(elements),len(cls._entityDef))
         for i,entityDef in enumerate(cls._entityDef[:count]):
             info = elements[i]
-            msg = entityDef(None,info.Part,info.Subname,info.Shape)
+            msg = _checkElement(entityDef,info,cache)
             if msg:
                 raise RuntimeError('Constraint "{}" requires the {} element '
                     'to be of {}'.format(cls.getName(),_ordinal[i],msg))
@@ -908,7 +1008,7 @@ class BaseMulti(Base):
             return
         i = len(cls._entityDef)
         for info in elements[i:]:
-            msg = cls._entityDef[0](None,info.Part,info.Subname,info.Shape)
+            msg = _checkElement(cls._entityDef[0],info,cache)
             if msg:
                 raise RuntimeError('Constraint "{}" requires the {} element '
                     'onwards to all be of {}'.format(
@@ -937,6 +1037,12 @@ class BaseMulti(Base):
             for element in elements[1:]:
                 for info in element.Proxy.getInfo(expand=True):
                     info0 = firstInfo[idx]
+                    if solver.isBroadcastPart(info0.Part):
+                        # placement derived from the first instance
+                        idx += 1
+                        if idx >= count:
+                            return ret
+                        continue
                     partInfo0 = solver.getPartInfo(info0)
                     partInfo = solver.getPartInfo(info)
                     e0 = cls._entityDef[0](
@@ -944,12 +1050,12 @@ class BaseMulti(Base):
                     e = cls._entityDef[0](
                             solver,partInfo,info.Subname,info.Shape)
                     params = props + [e0,e]
-                    solver.system.checkRedundancy(obj,partInfo0,partInfo)
-                    h = func(*params,group=solver.group)
-                    if isinstance(h,(list,tuple)):
-                        ret += list(h)
-                    else:
-                        ret.append(h)
+                    if solver.system.checkRedundancy(obj,partInfo0,partInfo):
+                        h = func(*params,group=solver.group)
+                        if isinstance(h,(list,tuple)):
+                            ret += list(h)
+                        else:
+                            ret.append(h)
                     idx += 1
                     if idx >= count:
                         return ret
@@ -957,7 +1063,7 @@ class BaseMulti(Base):
 
         parts = set()
         ref = None
-        elements = []
+        infos = []
 
         for e in obj.Proxy.getElements():
             info = e.Proxy.getInfo()
@@ -972,17 +1078,16 @@ class BaseMulti(Base):
                         cstrName(obj),info.PartName,ref.PartName))
                     continue
                 ref = info
-            elements.append(e)
+            infos.append(info)
 
-        if len(elements)<=1:
+        if len(infos)<=1:
             logger.warn('{} has no effective constraint'.format(cstrName(obj)))
             return
         e0 = None
         e = None
         info0 = None
         idx0 = 1 if len(cls._entityDef)>1 else 0
-        for i,element in enumerate(elements):
-            info = element.Proxy.getInfo()
+        for i,info in enumerate(infos):
             partInfo = solver.getPartInfo(info)
             if i==idx0:
                 e0 = cls._entityDef[idx0](
@@ -993,10 +1098,12 @@ class BaseMulti(Base):
             if e0 and e:
                 if idx0:
                     params = props + [e,e0]
-                    solver.system.checkRedundancy(obj,partInfo,info0)
+                    if not solver.system.checkRedundancy(obj,partInfo,info0):
+                        continue
                 else:
                     params = props + [e0,e]
-                    solver.system.checkRedundancy(obj,info0,partInfo)
+                    if not solver.system.checkRedundancy(obj,info0,partInfo):
+                        continue
                 h = func(*params,group=solver.group)
                 if isinstance(h,(list,tuple)):
                     ret += list(h)
@@ -1029,7 +1136,8 @@ class BaseCascade(BaseMulti):
                 params = props + [e1,e2]
             else:
                 params = props + [e2,e1]
-            solver.system.checkRedundancy(obj,prevInfo,partInfo)
+            if not solver.system.checkRedundancy(obj,prevInfo,partInfo):
+                continue
             h = func(*params,group=solver.group)
             if isinstance(h,(list,tuple)):
                 ret += list(h)
@@ -1058,6 +1166,49 @@ class PlaneCoincident(BaseCascade):
       'Add a "{}" constraint to conincide planar faces of two or more parts.\n'\
       'The faces are coincided at their centers with an optional distance.'
 
+    @classmethod
+    def isRigid(cls,obj):
+        return bool(obj.LockAngle)
+
+    @classmethod
+    def getRigidPairs(cls,obj,solver):
+        if not cls.isRigid(obj) or Constraint.canMultiply(obj):
+            return
+        d,dx,dy,_,yaw,pitch,roll = cls.getPropertyValues(obj)[:7]
+        offset = FreeCAD.Placement(FreeCAD.Vector(dx,dy,d),
+                FreeCAD.Rotation(yaw,pitch,roll))
+        infos = [e.Proxy.getInfo() for e in obj.Proxy.getElements()]
+        for info in infos:
+            if utils.isDraftObject(info.Part):
+                return
+        ret = []
+        # same element pairing as prepare()
+        if getattr(obj,'Cascade',True):
+            prev = None
+            for info in infos:
+                if prev and prev.Part!=info.Part:
+                    if solver.isFixedPart(info.Part):
+                        ret.append((prev,info,offset))
+                    else:
+                        ret.append((info,prev,offset))
+                prev = info
+            return ret
+        parts = set()
+        ref = None
+        filtered = []
+        for info in infos:
+            if info.Part in parts:
+                continue
+            parts.add(info.Part)
+            if solver.isFixedPart(info.Part):
+                if ref:
+                    continue
+                ref = info
+            filtered.append(info)
+        for info in filtered[1:]:
+            ret.append((filtered[0],info,offset))
+        return ret
+
 
 class AxialAlignment(BaseMulti):
     _id = 36
@@ -1401,8 +1552,8 @@ class BaseDraftWire(BaseSketch):
     _id = -1
 
     @classmethod
-    def check(cls,elements,checkCount=False):
-        super(BaseDraftWire,cls).check(elements,checkCount)
+    def check(cls,elements,checkCount=False,cache=None):
+        super(BaseDraftWire,cls).check(elements,checkCount,cache)
         if not checkCount:
             return
         for info in elements:
@@ -1419,6 +1570,7 @@ class LineLength(BaseSketch):
     _props = ["Length"]
     _iconName = 'Assembly_ConstraintLineLength.svg'
     _tooltip='Add a "{}" constrain the length of a none-subdivided Draft.Wire'
+    _cstrFuncName = 'addPointsDistance'
 
     @classmethod
     def init(cls,obj):
@@ -1427,7 +1579,7 @@ class LineLength(BaseSketch):
 
     @classmethod
     def prepare(cls,obj,solver):
-        func = cls.constraintFunc(obj,solver,'addPointsDistance')
+        func = cls.constraintFunc(obj,solver)
         if not func:
             return
         _,p0,p1 = cls.getEntities(obj,solver,retAll=True)[0]
@@ -1479,8 +1631,8 @@ class EqualLineArcLength(BaseSketch):
     _tooltip='Add a "{}" constraint to make a line of the same length as an arc'
 
     @classmethod
-    def check(cls,elements,checkCount=False):
-        super(EqualLineArcLength,cls).check(elements,checkCount)
+    def check(cls,elements,checkCount=False,cache=None):
+        super(EqualLineArcLength,cls).check(elements,checkCount,cache)
         if not checkCount:
             return
         for i,info in enumerate(elements):
@@ -1517,8 +1669,8 @@ class EqualRadius(BaseSketch):
     _tooltip='Add a "{}" constraint to make two circles/arcs of the same radius'
 
     @classmethod
-    def check(cls,elements,checkCount=False):
-        super(EqualRadius,cls).check(elements,checkCount)
+    def check(cls,elements,checkCount=False,cache=None):
+        super(EqualRadius,cls).check(elements,checkCount,cache)
         if not checkCount:
             return
         for info in elements:
@@ -451,6 +451,31 @@ class AsmCmdTrace(AsmCmdCheckable):
         except Exception:
             cls._object = None
 
+class AsmCmdExportTrace(AsmCmdBase):
+    _id = 19
+    _menuText = 'Export part move trace'
+    _tooltip = 'Export the placements of the parts recorded while tracing\n'\
+               'the last part move to a CSV file'
+    _iconName = 'Assembly_Trace.svg'
+    _toolbarName = None
+
+    @classmethod
+    def IsActive(cls):
+        from . import mover
+        trace = mover.AsmMovingPart.LastTrace
+        return True if trace and trace.frames else False
+
+    @classmethod
+    def Activated(cls):
+        from PySide import QtGui
+        from . import mover
+        path,_ = QtGui.QFileDialog.getSaveFileName(
+                FreeCADGui.getMainWindow(),'Export trace','',
+                'CSV files (*.csv)')
+        if path:
+            logger.report('command "{}" exception'.format(cls.getName()),
+                    mover.AsmMovingPart.LastTrace.export,path)
+
 class AsmCmdAutoRecompute(AsmCmdCheckable):
     _id = 5
     _menuText = 'Auto recompute'
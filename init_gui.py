@@ -12,6 +12,7 @@ except ImportError as e:
     import sys
     if not 'freecad.asm3.sys_slvs' in sys.modules:
         logger.warn('no solver backend found')
+from . import sys_auto
 
 class Assembly3Workbench(FreeCADGui.Workbench):
     from . import utils
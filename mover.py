@@ -1,4 +1,4 @@
-import math
+import math, time, csv
 from collections import namedtuple
 import FreeCAD, FreeCADGui
 from PySide import QtCore, QtGui
@@ -11,7 +11,124 @@ from .constraint import Constraint
 MovingPartInfo = namedtuple('MovingPartInfo',
         ('Hierarchy','ElementInfo','SelObj','SelSubname'))
 
+class DragStats(object):
+    'Frame time statistics of a dragging session'
+    __slots__ = ('count','skipped','time','maxTime')
+
+    def __init__(self):
+        self.count = 0
+        self.skipped = 0
+        self.time = 0.0
+        self.maxTime = 0.0
+
+    def addFrame(self,elapsed):
+        self.count += 1
+        self.time += elapsed
+        self.maxTime = max(self.maxTime,elapsed)
+
+    @property
+    def Average(self):
+        return self.time/self.count if self.count else 0.0
+
+    def __str__(self):
+        return '{} frames, {} events skipped, average {:.1f}ms, ' \
+               'max {:.1f}ms'.format(self.count,self.skipped,
+                       self.Average*1000,self.maxTime*1000)
+
+class TraceRecorder(object):
+    '''
+    Record the traced position into a Part::Polygon, dropping points too close
+    to the last recorded one, and updating the polygon at a bounded rate. The
+    full resolution trajectory of the parts is kept for export()
+    '''
+    # minimum distance between two recorded points relative to the size of the
+    # moving part
+    Decimation = 1e-3
+
+    # minimum interval in ms between two updates of the polygon
+    FlushInterval = 100
+
+    def __init__(self,start,size):
+        self.polygon = None
+        self.lastPoint = start
+        # the last point written to the polygon
+        self.flushed = start
+        self.pending = []
+        self.scheduled = False
+        self.minDistance = max(size*self.Decimation,1e-5)
+        self.startTime = time.time()
+        # (time,part name,x,y,z,qx,qy,qz,qw) of the parts whenever moved
+        self.frames = []
+        self.placements = {}
+
+    def addPoint(self,pos):
+        if self.lastPoint.distanceToPoint(pos) < self.minDistance:
+            return
+        self.lastPoint = pos
+        self.pending.append(pos)
+        if not self.scheduled:
+            self.scheduled = True
+            QtCore.QTimer.singleShot(self.FlushInterval,self.flush)
+
+    def addFrame(self,parts):
+        'record the placement of the given parts changed since the last frame'
+        t = time.time()-self.startTime
+        for part in parts:
+            pla = getattr(part,'Placement',None)
+            if pla is None:
+                continue
+            last = self.placements.get(part,None)
+            if last and utils.isSamePlacement(last,pla):
+                continue
+            self.placements[part] = pla
+            base = pla.Base
+            self.frames.append((t,part.Name,base.x,base.y,base.z) +
+                    pla.Rotation.Q)
+
+    def flush(self):
+        'write the pending points to the polygon'
+        self.scheduled = False
+        if not self.pending:
+            return
+        doc = FreeCAD.ActiveDocument
+        try:
+            # check if the object is deleted
+            self.polygon.Name
+        except Exception:
+            self.polygon = None
+        if not doc:
+            nodes = None
+        elif self.polygon:
+            nodes = self.polygon.Nodes
+        else:
+            self.polygon = doc.addObject('Part::Polygon','AsmTrace')
+            nodes = [self.flushed]
+        if nodes is not None:
+            self.polygon.Nodes = nodes + self.pending
+            self.polygon.recompute()
+        self.flushed = self.pending[-1]
+        self.pending = []
+
+    def export(self,path):
+        'write the recorded trajectory to a CSV file'
+        with open(path,'w') as f:
+            writer = csv.writer(f,lineterminator='\n')
+            writer.writerow(('time','part','x','y','z','qx','qy','qz','qw'))
+            writer.writerows(self.frames)
+        logger.info('exported {} trace records to {}'.format(
+            len(self.frames),path))
+
 class AsmMovingPart(object):
+    # statistics of the last dragging session
+    LastStats = None
+
+    # trace of the last moving session, see TraceRecorder
+    LastTrace = None
+
+    # Whether to move the parts by a first order prediction while dragging,
+    # if supported by the solver backend, see solver.DragPreview
+    Preview = True
+
     def __init__(self,hierarchy,info):
         self.objs = [h.Assembly for h in reversed(hierarchy)]
         self.assembly = resolveAssembly(info.Parent)
@@ -19,7 +136,8 @@ class AsmMovingPart(object):
         self.info = info
         self.undos = None
 
-        fixed = Constraint.getFixedTransform(self.assembly.getConstraints())
+        fixed = Constraint.getFixedTransform(
+                self.assembly.getConstraints(),self.assembly)
         fixed = fixed.get(info.Part,None)
         self.fixedTransform = fixed
         if fixed and fixed.Shape:
@@ -59,6 +177,15 @@ class AsmMovingPart(object):
         self.draggerPlacement = info.Placement.multiply(pla)
         self.trace = None
         self.tracePoint = None
+        self.coarse = False
+        # constraints solved while dragging, see solver.getDragCluster()
+        self.dragCluster = None
+        # None if to be linearized, or False if not supported
+        self.preview = None
+        self.stats = DragStats()
+        # whether there is a dragger motion not moved to yet
+        self.pending = False
+        self.moving = False
 
     @classmethod
     def onRollback(cls):
@@ -71,10 +198,85 @@ class AsmMovingPart(object):
             if movingPart:
                 vobj.Object.recompute(True)
                 movingPart.tracePoint = movingPart.TracePosition
+                if movingPart.trace:
+                    movingPart.trace.lastPoint = movingPart.tracePoint
 
     def begin(self):
         self.tracePoint = self.TracePosition
 
+    def onDragStart(self):
+        from . import solver
+        self.dragCluster = logger.catch('exception when finding drag cluster',
+                solver.getDragCluster, self.assembly.Object, self.info.Part)
+        self.preview = None
+        self.linearize()
+        self.stats = DragStats()
+        self.pending = False
+        if gui.AsmCmdManager.Trace:
+            self.getTrace()
+
+    def linearize(self):
+        'prepare the drag preview at the current placements'
+        if not self.Preview or self.preview is False or \
+           not gui.AsmCmdManager.AutoRecompute:
+            return
+        from . import solver
+        self.preview = logger.catch('exception when linearizing part move',
+                solver.DragPreview.make, self.assembly.Object, self.info.Part,
+                self.dragCluster)
+        if not self.preview:
+            self.preview = False
+
+    def onDragMotion(self):
+        '''
+        Moving to the dragger placement is deferred until the queued motion
+        events are processed, so that only the latest one is moved to, instead
+        of lagging behind the cursor when moving is slower than the events.
+
+        Always return the dragger placement, so that the motion is treated as
+        handled, instead of moving the assembly itself.
+        '''
+        if self.pending:
+            self.stats.skipped += 1
+            return self.draggerPlacement
+        self.pending = True
+        if not self.moving:
+            QtCore.QTimer.singleShot(0,self.flush)
+        return self.draggerPlacement
+
+    def flush(self):
+        'move to the latest dragger placement if not done yet'
+        if not self.pending or self.moving:
+            return
+        self.pending = False
+        self.moving = True
+        start = time.time()
+        try:
+            self.move()
+        finally:
+            self.moving = False
+            self.stats.addFrame(time.time()-start)
+        if self.pending:
+            # more motion while moving
+            QtCore.QTimer.singleShot(0,self.flush)
+
+    def end(self):
+        self.flush()
+        self.pending = False
+        AsmMovingPart.LastStats = self.stats
+        logger.debug('part move {}'.format(self.stats))
+        if self.trace:
+            self.trace.flush()
+        self.dragCluster = None
+        self.preview = None
+        if not self.coarse:
+            return
+        self.coarse = False
+        # refine the coarse solution obtained during dragging
+        from . import solver
+        logger.catch('solver exception when refining moved part',
+                solver.solve, self.objs, dragPart=self.info.Part)
+
     def update(self):
         info = getElementInfo(self.info.Parent,self.info.SubnameRef)
         self.info = info
@@ -108,6 +310,8 @@ class AsmMovingPart(object):
         obj = self.assembly.Object
         pla = self.viewObject.DraggingPlacement
         updatePla = True
+        autoSolve = gui.AsmCmdManager.AutoRecompute and \
+            QtGui.QApplication.keyboardModifiers()!=QtCore.Qt.ControlModifier
 
         rollback = []
         if not info.Subname.startswith('Face') and utils.isDraftWire(part):
@@ -168,11 +372,19 @@ class AsmMovingPart(object):
         if updatePla:
             # obtain and update the part placement
             pla = pla.multiply(self.offsetInv)
+            if autoSolve and self.preview:
+                if logger.catch('exception when previewing part move',
+                        self.preview.move, pla, rollback):
+                    # refined by end()
+                    self.coarse = True
+                    self.updateTrace()
+                    return self.draggerPlacement
+                # drifted too far, solve and linearize again below
+                self.preview = None
             setPlacement(info.Part,pla)
             rollback.append((info.PartName,info.Part,info.Placement.copy()))
 
-        if not gui.AsmCmdManager.AutoRecompute or \
-           QtGui.QApplication.keyboardModifiers()==QtCore.Qt.ControlModifier:
+        if not autoSolve:
             # AsmCmdManager.AutoRecompute means auto re-solve the system. The
             # recompute() call below is only for updating linked element and
             # stuff
@@ -183,24 +395,15 @@ class AsmMovingPart(object):
         # to logger only.
         from . import solver
         if not logger.catch('solver exception when moving part',
-               solver.solve, self.objs, dragPart=info.Part, rollback=rollback):
+               solver.solve, self.objs, dragPart=info.Part, rollback=rollback,
+               coarse=True, dragCluster=self.dragCluster):
             obj.recompute(True)
+        else:
+            self.coarse = True
+            if self.preview is None:
+                self.linearize()
 
-        if gui.AsmCmdManager.Trace:
-            pos = self.TracePosition
-            if not self.tracePoint.isEqual(pos,1e-5):
-                try:
-                    # check if the object is deleted
-                    self.trace.Name
-                except Exception:
-                    self.trace = None
-                if not self.trace:
-                    self.trace = FreeCAD.ActiveDocument.addObject(
-                        'Part::Polygon','AsmTrace')
-                    self.trace.Nodes = [self.tracePoint]
-                self.tracePoint = pos
-                self.trace.Nodes = {-1:pos}
-                self.trace.recompute()
+        self.updateTrace()
 
         # self.draggerPlacement, which holds the intended dragger placement, is
         # updated by the above solver call through the following chain, 
@@ -210,6 +413,20 @@ class AsmMovingPart(object):
         #   AsmMovingPart.update()
         return self.draggerPlacement
 
+    def getTrace(self):
+        if not self.trace:
+            self.trace = TraceRecorder(self.tracePoint,
+                    self.bbox.DiagonalLength)
+            AsmMovingPart.LastTrace = self.trace
+            self.trace.addFrame(self.assembly.getPartGroup().Group)
+        return self.trace
+
+    def updateTrace(self):
+        if gui.AsmCmdManager.Trace:
+            trace = self.getTrace()
+            trace.addPoint(self.TracePosition)
+            trace.addFrame(self.assembly.getPartGroup().Group)
+
 def checkFixedPart(info):
     if not gui.AsmCmdManager.LockMover:
         return
@@ -373,8 +590,12 @@ class AsmDocumentObserver:
     def slotNewDocument(self,_doc):
         self.closeMover()
 
-    def slotDeleteDocument(self,_doc):
+    def slotDeleteDocument(self,doc):
         self.closeMover()
+        Assembly.onDeleteDocument(doc)
+
+    def slotDeletedObject(self,obj):
+        Assembly.onDeletedObject(obj)
 
     def slotUndoDocument(self,_doc):
         self.closeMover()
@@ -1,9 +1,11 @@
-import random, math
+import random, math, time, threading
 from collections import namedtuple
 import FreeCAD, FreeCADGui
-from .assembly import Assembly, isTypeOf, setPlacement
+from PySide import QtCore
+from .assembly import Assembly, isTypeOf, setPlacement, getPlacement
 from . import utils
 from .utils import syslogger as logger, objName, isSamePlacement
+from .FCADLogger import FCADLogger
 from .constraint import Constraint, cstrName, \
                         NormalInfo, PlaneInfo, PointInfo
 from .system import System
@@ -24,10 +26,153 @@ from .system import System
 PartInfo = namedtuple('SolverPartInfo', ('Part','PartName','Placement',
     'Params','Workplane','EntityMap','Group','CstrMap'))
 
+# Persistent state of a prepared problem, kept by backends that reuse their
+# system between solves.
+#
+# Key: structure key of the problem, see _getSessionKey()
+# PartMap, CstrMap, FixedParts, FixedElements, Broadcast, ClosedForm, Scale:
+#   the corresponding Solver states
+# Constants: the Solver's convenience entities
+SolverSession = namedtuple('SolverSession', ('Key','PartMap','CstrMap',
+    'FixedParts','FixedElements','Broadcast','ClosedForm','Scale',
+    'Constants'))
+
+def _getConstraintKey(cstr):
+    # Reuse the key of a constraint not changed since last time. The key of a
+    # locked constraint also depends on the part placement, so is not cached.
+    key = getattr(cstr.Proxy,'solverKey',None)
+    if key and not getattr(cstr.Proxy,'dirty',True):
+        return key
+    cstr.Proxy.solverKey = None
+
+    proxy = Constraint.getProxy(cstr)
+    key = [cstr,Constraint.getTypeID(cstr)]
+    for name in proxy.getPropertyInfoList():
+        key.append(Constraint.getPropertyInfo(name).get(cstr))
+    locked = proxy.hasFixedPart(cstr)
+    for element in cstr.Proxy.getElements():
+        for info in element.Proxy.getInfo(expand=True):
+            if utils.isDraftObject(info.Part):
+                # draft objects are solved by their points, not placement
+                return
+            key.append((info.Part,info.Subname,utils.getShapeKey(info.Shape)))
+            if locked:
+                # locked elements are added as constants in global coordinates
+                key.append(utils.getPlacementKey(info.Placement))
+    key = tuple(key)
+    if not locked:
+        cstr.Proxy.solverKey = key
+        cstr.Proxy.dirty = False
+    return key
+
+def _getSessionKey(assembly,cstrs,partGroup,dragPart):
+    '''
+    Return a key that changes whenever the problem has to be prepared again,
+    or None if the problem cannot be reused.
+    '''
+    key = [assembly.AutoRelax,dragPart]
+    # inputs of Constraint.getFixedParts() other than the constraints
+    if partGroup.Proxy.derivedParts:
+        key.append(tuple(partGroup.Proxy.derivedParts))
+    for obj in partGroup.Group:
+        if not hasattr(obj,'Placement') or getattr(obj,'Fixed',False):
+            key.append(obj)
+    for cstr in cstrs:
+        ckey = _getConstraintKey(cstr)
+        if ckey is None:
+            return
+        key.append(ckey)
+    return tuple(key)
+
+# Constraints of an assembly to be solved while dragging one of its parts,
+# see getDragCluster()
+DragCluster = namedtuple('DragCluster', ('Assembly','Constraints'))
+
+def getDragCluster(assembly,dragPart):
+    '''
+    Return the constraints reachable from the dragged part through non-fixed
+    parts, together with those fixing the parts reached. The rest of the
+    assembly is not affected by dragging, and can be left out of solving.
+
+    Return None if the whole assembly has to be solved.
+    '''
+    cstrs = assembly.Proxy.getConstraints()
+    partGroup = assembly.Proxy.getPartGroup()
+    fixed,found,firstInfo = Constraint.findFixedParts(cstrs,partGroup)
+    if not found:
+        if not firstInfo:
+            return
+        fixed = set(fixed)
+        fixed.add(firstInfo.Part)
+
+    def isFixed(part):
+        if isinstance(part,tuple) and part[0] in fixed:
+            return True
+        return part in fixed
+
+    partMap = {}
+    arrayMap = {}
+    cstrParts = []
+    for i,cstr in enumerate(cstrs):
+        parts = set()
+        for element in cstr.Proxy.getElements():
+            for info in element.Proxy.getInfo(expand=True):
+                parts.add(info.Part)
+        cstrParts.append(parts)
+        for part in parts:
+            partMap.setdefault(part,[]).append(i)
+            if isinstance(part,tuple):
+                arrayMap.setdefault(part[0],set()).add(part)
+
+    if dragPart not in partMap or isFixed(dragPart):
+        return
+    reached = set((dragPart,))
+    queue = [dragPart]
+    indices = set()
+    for part in queue:
+        if isFixed(part):
+            continue
+        neighbours = set()
+        for i in partMap.get(part,()):
+            indices.add(i)
+            neighbours.update(cstrParts[i])
+        # moving an array moves its elements, and vice versa
+        if isinstance(part,tuple):
+            neighbours.add(part[0])
+        else:
+            neighbours.update(arrayMap.get(part,()))
+        for p in neighbours:
+            if p not in reached:
+                reached.add(p)
+                queue.append(p)
+
+    for i,cstr in enumerate(cstrs):
+        if Constraint.getProxy(cstr).hasFixedPart(cstr):
+            # keep all fixed parts, which are cheap to prepare
+            indices.add(i)
+        elif not found and firstInfo.Part in cstrParts[i]:
+            # keep the part fixed by default the same, as it comes from the
+            # first constraint with any element
+            indices.add(i)
+            found = True
+    if len(indices) == len(cstrs):
+        return
+    logger.debug('drag cluster of {} has {} out of {} constraints'.format(
+        objName(assembly),len(indices),len(cstrs)))
+    return DragCluster(assembly,[cstrs[i] for i in sorted(indices)])
+
 class Solver(object):
-    def __init__(self,assembly,reportFailed,dragPart,recompute,rollback):
+    def __init__(self,assembly,reportFailed,dragPart,recompute,rollback,
+            coarse=False,cstrs=None,deferred=False):
+        # whether the system is only solved to a coarse tolerance, and needs
+        # to be refined later
+        self.coarse = False
+        # whether there is a prepared system to solve. If deferred, it is left
+        # to the caller to call solveSystem() and apply()
+        self.prepared = False
         self.system = System.getSystem(assembly)
-        cstrs = assembly.Proxy.getConstraints()
+        if cstrs is None:
+            cstrs = assembly.Proxy.getConstraints()
         if not cstrs:
             logger.debug('skip assembly {} with no constraint'.format(
                 objName(assembly)))
@@ -38,84 +183,132 @@ class Solver(object):
         self._partMap = {}
         self._cstrMap = {}
         self._fixedElements = set()
+        self._broadcast = {}
+        self._closedForm = []
+        self._closedPlacements = {}
 
-        self.system.GroupHandle = self._fixedGroup
-
-        # convenience constant of zero and one
-        self.v0 = self.system.addParamV(0,group=self._fixedGroup)
-        self.v1 = self.system.addParamV(1,group=self._fixedGroup)
-
-        # convenience x normals
-        rotx = FreeCAD.Rotation(FreeCAD.Vector(0,1,0),-90)
-        self.nx = self.system.addNormal3dV(*utils.getNormal(rotx))
-
-        # convenience x pointing vector
-        self.px = self.system.addPoint3d(self.v1,self.v0,self.v0)
+        partGroup = assembly.Proxy.getPartGroup()
 
-        # convenience y normals
-        roty = FreeCAD.Rotation(FreeCAD.Vector(1,0,0),90)
-        self.ny = self.system.addNormal3dV(*utils.getNormal(roty))
+        # element geometry found in the previous and the current preparation
+        self._geometryCache = getattr(assembly.Proxy,'geometryCache',{})
+        self._geometry = {}
+        # shape hash -> geometry entry, for sharing among element copies
+        self._sharedGeometry = {}
 
-        partGroup = assembly.Proxy.getPartGroup()
-        self._fixedParts = Constraint.getFixedParts(self,cstrs,partGroup)
-        for part in self._fixedParts:
-            self._fixedElements.add((part,None))
+        # Backends supporting system reuse expose a 'session' attribute for
+        # holding the previously prepared problem, which can be solved again
+        # with updated part placements if nothing else has changed.
+        sessionKey = None
+        session = getattr(self.system,'session',False)
+        if session is not False:
+            sessionKey = _getSessionKey(assembly,cstrs,partGroup,dragPart)
+            if session and session.Key != sessionKey:
+                self.system = System.getSystem(assembly,True)
+                session = None
 
-        for cstr in cstrs:
-            self.system.log('preparing {}'.format(cstrName(cstr)))
-            self.system.GroupHandle += 1
-            ret = Constraint.prepare(cstr,self)
-            if ret:
-                if isinstance(ret,(list,tuple)):
-                    for h in ret:
-                        if not isinstance(h,(list,tuple)):
-                            self._cstrMap[h] = cstr
-                else:
-                    self._cstrMap[ret] = cstr
+        if session:
+            self.system.log('reuse solver session')
+            self._restoreSession(session)
+        else:
+            self._prepare(cstrs,partGroup,dragPart)
+            # only keep the geometry of elements still in use
+            assembly.Proxy.geometryCache = self._geometry
+            # and the element checks of parts still in use
+            cache = getattr(assembly.Proxy,'elementCheckCache',None)
+            if cache:
+                assembly.Proxy.elementCheckCache = dict((k,v)
+                    for k,v in cache.items() if k[1] in self._partMap)
+            if sessionKey is not None:
+                self.system.session = SolverSession(Key=sessionKey,
+                        PartMap=self._partMap,
+                        CstrMap=self._cstrMap,
+                        FixedParts=self._fixedParts,
+                        FixedElements=self._fixedElements,
+                        Broadcast=self._broadcast,
+                        ClosedForm=self._closedForm,
+                        Scale=self._scale,
+                        Constants=(self.v0,self.v1,self.nx,self.px,self.ny))
 
-        if dragPart:
-            # TODO: this is ugly, need a better way to expose dragging interface
-            addDragPoint = getattr(self.system,'addWhereDragged',None)
-            if addDragPoint:
-                info = self._partMap.get(dragPart,None)
-                if info and info.Workplane:
-                    # add dragging point
-                    self.system.log('add drag point '
-                        '{}'.format(info.Workplane[1]))
-                    # TODO: slvs addWhereDragged doesn't work as expected, need
-                    # to investigate more
-                    # addDragPoint(info.Workplane[1],group=self.group)
+        if coarse and hasattr(self.system,'coarse'):
+            self.system.coarse = True
 
+        self._assembly = assembly
+        self._cstrs = cstrs
+        self._reportFailed = reportFailed
+        self._hasSession = sessionKey is not None
+        self.prepared = True
         self.system.log('solving {}'.format(objName(assembly)))
+        if deferred:
+            return
         try:
-            self.system.solve(group=self.group,reportFailed=reportFailed)
-        except RuntimeError as e:
-            if reportFailed and self.system.Failed:
-                msg = 'List of failed constraint:'
-                for h in self.system.Failed:
-                    cstr = self._cstrMap.get(h,None)
-                    if not cstr:
-                        try:
-                            c = self.system.getConstraint(h)
-                        except Exception as e2:
-                            logger.error('cannot find failed constraint '
-                                    '{}: {}'.format(h,e2))
-                            continue
-                        if c.group <= self._fixedGroup or \
-                           c.group-self._fixedGroup >= len(cstrs):
-                            logger.error('failed constraint in unexpected group'
-                                    ' {}'.format(c.group))
-                            continue
-                        cstr = cstrs[c.group-self._fixedGroup]
-                    msg += '\n{}, handle: {}'.format(cstrName(cstr),h)
-                logger.error(msg)
-            raise RuntimeError('Failed to solve {}: {}'.format(
-                objName(assembly),str(e)))
+            self.solveSystem()
+        except Exception as e:
+            self.onFailed(e)
+        self.apply(recompute,rollback)
+
+    def solveSystem(self):
+        '''
+        Solve the prepared system. Unlike the preparation and apply(), it does
+        not access any document object, so can be run in a worker thread.
+        '''
+        self.system.solve(group=self.group,reportFailed=self._reportFailed)
         self.system.log('done solving')
 
+    def onFailed(self,e):
+        'Report the exception raised by solveSystem(), and raise RuntimeError'
+        assembly = self._assembly
+        cstrs = self._cstrs
+        if self._hasSession:
+            # discard the session, as the system state is now unreliable
+            self.system.session = None
+        if self._reportFailed and self.system.Failed:
+            msg = 'List of failed constraint:'
+            for h in self.system.Failed:
+                cstr = self._cstrMap.get(h,None)
+                if not cstr:
+                    try:
+                        c = self.system.getConstraint(h)
+                    except Exception as e2:
+                        logger.error('cannot find failed constraint '
+                                '{}: {}'.format(h,e2))
+                        continue
+                    if c.group <= self._fixedGroup or \
+                       c.group-self._fixedGroup >= len(cstrs):
+                        logger.error('failed constraint in unexpected group'
+                                ' {}'.format(c.group))
+                        continue
+                    cstr = cstrs[c.group-self._fixedGroup]
+                msg += '\n{}, handle: {}'.format(cstrName(cstr),h)
+            logger.error(msg)
+        raise RuntimeError('Failed to solve {}: {}'.format(
+            objName(assembly),str(e)))
+
+    def apply(self,recompute,rollback):
+        'Write the solved placements back to the parts'
+        assembly = self._assembly
+        self.coarse = getattr(self.system,'coarse',False)
+
+        redundant = getattr(self.system,'Redundant',None)
+        if redundant:
+            names = []
+            for h in redundant:
+                cstr = self._cstrMap.get(h,None)
+                name = cstrName(cstr) if cstr else str(h)
+                if name not in names:
+                    names.append(name)
+            msg = 'Redundant constraints removed when solving {}:\n{}'.format(
+                    objName(assembly),'\n'.join(names))
+            if self._reportFailed:
+                logger.warn(msg)
+            else:
+                self.system.log(msg)
+
         touched = False
+        # solved placement of the parts, for deriving the broadcast ones
+        placements = {}
         for part,partInfo in self._partMap.items():
             if part in self._fixedParts:
+                placements[part] = partInfo.Placement
                 continue
             if utils.isDraftWire(part):
                 changed = False
@@ -149,6 +342,7 @@ class Solver(object):
                 p = params[:3]
                 q = (params[4],params[5],params[6],params[3])
                 pla = FreeCAD.Placement(FreeCAD.Vector(*p),FreeCAD.Rotation(*q))
+                placements[part] = pla
                 if isSamePlacement(partInfo.Placement,pla):
                     self.system.log('not moving {}'.format(partInfo.PartName))
                 else:
@@ -193,9 +387,352 @@ class Solver(object):
                         part.FirstAngle = v[1]
                         part.LastAngle = v[2]
 
+        for part,(template,base,rel) in self._broadcast.items():
+            if template not in placements or base not in placements:
+                continue
+            # The base part transforms the template's constraining element
+            # to this instance's one, and so does to the instance itself.
+            pbase = placements[base]
+            pla = pbase.multiply(rel).multiply(pbase.inverse()).multiply(
+                    placements[template])
+            old = getPlacement(part)
+            if isSamePlacement(old,pla):
+                continue
+            touched = True
+            name = '{}.{}'.format(part[0].Name,part[1])
+            self.system.log('broadcast {} {}'.format(name,pla))
+            if rollback is not None:
+                rollback.append((name,part,old))
+            setPlacement(part,pla)
+
         if recompute and touched:
             assembly.recompute(True)
 
+    def _prepare(self,cstrs,partGroup,dragPart):
+        self.system.GroupHandle = self._fixedGroup
+
+        # convenience constant of zero and one
+        self.v0 = self.system.addParamV(0,group=self._fixedGroup)
+        self.v1 = self.system.addParamV(1,group=self._fixedGroup)
+
+        # convenience x normals
+        rotx = FreeCAD.Rotation(FreeCAD.Vector(0,1,0),-90)
+        self.nx = self.system.addNormal3dV(*utils.getNormal(rotx))
+
+        # convenience x pointing vector
+        self.px = self.system.addPoint3d(self.v1,self.v0,self.v0)
+
+        # convenience y normals
+        roty = FreeCAD.Rotation(FreeCAD.Vector(1,0,0),90)
+        self.ny = self.system.addNormal3dV(*utils.getNormal(roty))
+
+        # Characteristic length of the assembly for nondimensionalizing the
+        # translation parameters, if supported by the backend. It only needs
+        # to be roughly right, so is computed once for the same parts, instead
+        # of getting all the part shapes on every solve.
+        self._scale = None
+        if getattr(self.system,'setParamScale',None):
+            proxy = partGroup.Proxy.getAssembly()
+            parts = tuple(partGroup.Group)
+            cache = getattr(proxy,'scaleCache',None)
+            if cache and cache[0] == parts:
+                self._scale = cache[1]
+            else:
+                bbox = utils.getBoundBox(parts)
+                if bbox.isValid() and bbox.DiagonalLength > 0:
+                    self._scale = bbox.DiagonalLength
+                proxy.scaleCache = (parts,self._scale)
+            self.system.log('translation scale {}'.format(self._scale))
+
+        self._fixedParts = Constraint.getFixedParts(self,cstrs,partGroup)
+        for part in self._fixedParts:
+            self._fixedElements.add((part,None))
+        addRigidParts = getattr(self.system,'addRigidParts',None)
+        if addRigidParts:
+            addRigidParts(self._fixedParts)
+
+        if getattr(self.system,'addSolvedPair',None):
+            self._closedForm = self._findClosedForm(cstrs,dragPart)
+            self._closedPlacements = self._placeClosedForm()
+
+        self._broadcast = self._findBroadcast(cstrs,dragPart)
+
+        for cstr in cstrs:
+            self.system.log('preparing {}'.format(cstrName(cstr)))
+            self.system.GroupHandle += 1
+            ret = Constraint.prepare(cstr,self)
+            if ret:
+                if isinstance(ret,(list,tuple)):
+                    for h in ret:
+                        if not isinstance(h,(list,tuple)):
+                            self._cstrMap[h] = cstr
+                else:
+                    self._cstrMap[ret] = cstr
+
+        if dragPart:
+            # TODO: this is ugly, need a better way to expose dragging interface
+            addDragPoint = getattr(self.system,'addWhereDragged',None)
+            if addDragPoint and not self.isFixedPart(dragPart):
+                info = self._partMap.get(dragPart,None)
+                if info and info.Workplane:
+                    # hold the origin of the dragged part at where it is
+                    # dragged, so that the other parts adjust to it
+                    h = info.Workplane.origin.entity
+                    self.system.log('add drag point {}'.format(h))
+                    addDragPoint(h,group=self.group)
+
+    def _restoreSession(self,session):
+        self._partMap = session.PartMap
+        self._cstrMap = session.CstrMap
+        self._fixedParts = session.FixedParts
+        self._fixedElements = session.FixedElements
+        self._broadcast = session.Broadcast
+        self._closedForm = session.ClosedForm
+        self._scale = session.Scale
+        self._closedPlacements = self._placeClosedForm()
+        self.v0,self.v1,self.nx,self.px,self.ny = session.Constants
+
+        # update the placement parameters in place
+        for part,partInfo in self._partMap.items():
+            pla = getPlacement(part)
+            self._partMap[part] = partInfo._replace(Placement=pla.copy())
+            pla = self._closedPlacements.get(part,pla)
+            q = pla.Rotation.Q
+            base = pla.Base
+            for h,v in zip(partInfo.Params,
+                    (base.x,base.y,base.z,q[3],q[0],q[1],q[2])):
+                self.system.getParam(h).val = v
+
+    def getGeometry(self,part,subname,shape,name,func):
+        '''
+        Return the geometry derived from the element shape by func. It is
+        cached across solves, as long as the element shape stays the same
+        '''
+        key = (part,subname)
+        entry = self._geometry.get(key,None)
+        if not entry:
+            entry = self._geometryCache.get(key,None)
+            # Holding the shape keeps its underlying data alive, so that
+            # isSame() can not be fooled by a reused one.
+            if not entry or not entry[0].isSame(shape):
+                # Elements of link arrays, or multiple links to the same
+                # object, usually share the same shape in part coordinates,
+                # and hence the same geometry.
+                entry = self._sharedGeometry.get(shape.hashCode(),None)
+                if not entry or not entry[0].isSame(shape):
+                    entry = (shape,{})
+            self._sharedGeometry.setdefault(shape.hashCode(),entry)
+            self._geometry[key] = entry
+        values = entry[1]
+        try:
+            return values[name]
+        except KeyError:
+            v = func(shape)
+            values[name] = v
+            return v
+
+    def _getElementPlacement(self,info):
+        'Return the placement of an element in its part coordinates'
+        return FreeCAD.Placement(
+            self.getGeometry(info.Part,info.Subname,info.Shape,
+                'pos',utils.getElementPos),
+            self.getGeometry(info.Part,info.Subname,info.Shape,
+                'rot',utils.getElementRotation))
+
+    def _getElementFrame(self,info):
+        '''
+        Return the placement of an element in its part coordinates, and a key of
+        the element geometry relative to that placement
+        '''
+        shape = info.Shape
+        pla = self._getElementPlacement(info)
+        def getKey(shape):
+            shape = shape.copy()
+            shape.transformShape(pla.inverse().toMatrix())
+            return utils.getShapeKey(shape)
+        key = self.getGeometry(info.Part,info.Subname,shape,'localKey',getKey)
+        return pla,key
+
+    def _findBroadcast(self,cstrs,dragPart):
+        '''
+        Find link array instances constrained by a multiplied constraint the
+        same way as the first instance, with congruent elements of a common
+        base part. They are not added to the system. Instead, their placements
+        are derived from the solved first instance. This only applies to
+        constraints leaving no freedom to the instances, and not to the dragged
+        instance.
+
+        Return a map from instance part to (first instance part, base part,
+        transformation from the first to this constraining element)
+        '''
+        ret = {}
+        multiplied = []
+        arrays = {}
+        others = set()
+        for cstr in cstrs:
+            elements = cstr.Proxy.getElements()
+            if Constraint.canMultiply(cstr) and Constraint.isRigid(cstr) and \
+               not getattr(cstr,'Cascade',False) and len(elements)>1:
+                info = elements[0].Proxy.getInfo()
+                if isinstance(info.Part,tuple):
+                    multiplied.append((cstr,elements))
+                    array = info.Part[0]
+                    arrays[array] = arrays.get(array,0)+1
+                    elements = elements[1:]
+            for element in elements:
+                part = element.Proxy.getInfo().Part
+                others.add(part[0] if isinstance(part,tuple) else part)
+
+        for cstr,elements in multiplied:
+            infos = elements[0].Proxy.getInfo(expand=True)
+            array = infos[0].Part[0]
+            if arrays[array]>1 or array in others:
+                continue
+            targets = []
+            for element in elements[1:]:
+                targets += element.Proxy.getInfo(expand=True)
+            pairs = list(zip(infos,targets))
+            if len(pairs)<=1:
+                continue
+            info0,target0 = pairs[0]
+            if self.isFixedPart(info0.Part) or self.isFixedPart(target0.Part):
+                continue
+            pla0,key0 = self._getElementFrame(target0)
+            count = 0
+            for info,target in pairs[1:]:
+                if info.Subname != info0.Subname or \
+                   not info.Shape.isSame(info0.Shape) or \
+                   target.Part != target0.Part or \
+                   info.Part == dragPart or \
+                   self.isFixedPart(info.Part):
+                    continue
+                pla,key = self._getElementFrame(target)
+                if key != key0:
+                    continue
+                ret[info.Part] = (info0.Part,target0.Part,
+                        pla.multiply(pla0.inverse()))
+                count += 1
+            if count:
+                self.system.log('{} broadcasts to {} instances'.format(
+                    cstrName(cstr),count))
+        return ret
+
+    def _findClosedForm(self,cstrs,dragPart):
+        '''
+        Find parts connected to the fixed parts only through constraints that
+        rigidly connect pairs of parts, e.g. plane coincidence with locked
+        angle. Their placements are computed directly instead of being solved.
+
+        Return a list of (part, parent part, transformation) in the order of
+        computing, with the part's placement being the parent's multiplied by
+        the transformation.
+        '''
+        def owner(part):
+            return part[0] if isinstance(part,tuple) else part
+
+        coupled = set()
+        if dragPart:
+            coupled.add(owner(dragPart))
+        pairs = []
+        for cstr in cstrs:
+            ret = Constraint.getRigidPairs(cstr,self)
+            if ret is None:
+                for element in cstr.Proxy.getElements():
+                    coupled.add(owner(element.Proxy.getInfo().Part))
+            else:
+                pairs += [(cstr,)+pair for pair in ret]
+        if not pairs:
+            return []
+
+        neighbours = {}
+        for i,(_,info1,info2,_) in enumerate(pairs):
+            neighbours.setdefault(info1.Part,[]).append(i)
+            neighbours.setdefault(info2.Part,[]).append(i)
+
+        def getOther(i,part):
+            _,info1,info2,_ = pairs[i]
+            return info2.Part if info1.Part==part else info1.Part
+
+        # Only take components of parts connected by rigid pairs, with none
+        # involved in other constraints.
+        eligible = set()
+        visited = set()
+        for part in neighbours:
+            if part in visited or self.isFixedPart(part):
+                continue
+            visited.add(part)
+            component = [part]
+            ok = True
+            for p in component:
+                if owner(p) in coupled:
+                    ok = False
+                for i in neighbours[p]:
+                    other = getOther(i,p)
+                    if self.isFixedPart(other):
+                        if not isinstance(other,tuple) and \
+                           not hasattr(other,'Placement'):
+                            ok = False
+                    elif other not in visited:
+                        visited.add(other)
+                        component.append(other)
+            if ok:
+                eligible.update(component)
+        if not eligible:
+            return []
+
+        ret = []
+        used = set()
+        placed = set()
+        queue = [p for p in neighbours if self.isFixedPart(p)]
+        for parent in queue:
+            for i in neighbours[parent]:
+                if i in used:
+                    continue
+                cstr,info1,info2,offset = pairs[i]
+                part = getOther(i,parent)
+                if part in placed or \
+                   (part not in eligible and parent in eligible):
+                    # the pair is over constrained, or is between a placed
+                    # part and a fixed one
+                    self.system.log('abort closed form at {}'.format(
+                        cstrName(cstr)))
+                    return []
+                if part not in eligible:
+                    continue
+                used.add(i)
+                placed.add(part)
+                queue.append(part)
+                # F1 = F2*offset, where Fi = Pi*Ei is the element placement,
+                # Pi the part placement, and Ei the element placement in part
+                # coordinates
+                pla1 = self._getElementPlacement(info1)
+                pla2 = self._getElementPlacement(info2)
+                if part == info1.Part:
+                    t = pla2.multiply(offset).multiply(pla1.inverse())
+                else:
+                    t = pla1.multiply(offset.inverse()).multiply(
+                            pla2.inverse())
+                ret.append((part,parent,t))
+
+        for i in used:
+            cstr,info1,info2,_ = pairs[i]
+            self.system.addSolvedPair(cstr,info1.Part,info2.Part)
+        if ret:
+            self.system.log('{} parts placed in closed form'.format(len(ret)))
+        return ret
+
+    def _placeClosedForm(self):
+        ret = {}
+        for part,parent,t in self._closedForm:
+            pla = ret.get(parent,None)
+            if pla is None:
+                pla = getPlacement(parent)
+            ret[part] = pla.multiply(t)
+        return ret
+
+    def isBroadcastPart(self,part):
+        return part in self._broadcast
+
     def isFixedPart(self,part):
         if isinstance(part,tuple) and part[0] in self._fixedParts:
             return True
@@ -213,7 +750,8 @@ class Solver(object):
         if partInfo:
             return partInfo
 
-        if fixed or info.Part in self._fixedParts:
+        if fixed or info.Part in self._fixedParts or \
+                    info.Part in self._closedPlacements:
             g = self._fixedGroup
         else:
             g = self.group
@@ -224,8 +762,12 @@ class Solver(object):
             params = None
             h = None
         else:
+            pla = self._closedPlacements.get(info.Part,info.Placement)
             self.system.NameTag = info.PartName
-            params = self.system.addPlacement(info.Placement,group=g)
+            params = self.system.addPlacement(pla,group=g)
+            if self._scale and g == self.group:
+                for p in params[:3]:
+                    self.system.setParamScale(p,self._scale)
 
             self.system.NameTag = info.PartName + '.p'
             p = self.system.addPoint3d(*params[:3],group=g)
@@ -246,7 +788,7 @@ class Solver(object):
                                      vector=FreeCAD.Vector()),
                     normal=NormalInfo(entity=n,rot=FreeCAD.Rotation(),
                                      params=params,p0=p0,ln=ln,p1=p1,px=px,
-                                     vx=FreeCAD.Vector(1), pla=info.Placement))
+                                     vx=FreeCAD.Vector(1), pla=pla))
 
         partInfo = PartInfo(Part = info.Part,
                             PartName = info.PartName,
@@ -262,8 +804,36 @@ class Solver(object):
         self._partMap[info.Part] = partInfo
         return partInfo
 
+def _solveAssembly(assembly,reportFailed,dragPart,recompute,rollback,coarse,
+        cstrs=None):
+    while True:
+        start = time.time()
+        try:
+            try:
+                solver = Solver(assembly,reportFailed,dragPart,recompute,
+                        rollback,coarse,cstrs)
+            except RuntimeError as e:
+                if not dragPart:
+                    raise
+                # The dragged position may not be reachable, e.g. when the
+                # part has less degree of freedom left than the drag point
+                # takes. Retry without holding the part.
+                logger.debug('retry without drag point: {}'.format(e))
+                solver = Solver(assembly,reportFailed,None,recompute,
+                        rollback,coarse,cstrs)
+        except RuntimeError:
+            # give the solver system a chance to try another backend
+            if not System.onSolved(assembly,time.time()-start,True):
+                raise
+            continue
+        elapsed = time.time()-start
+        System.onSolved(assembly,elapsed)
+        assembly.Proxy.updateSolveTime(elapsed)
+        return solver
+
 def _solve(objs=None,recursive=None,reportFailed=False,
-        recompute=True,dragPart=None,rollback=None):
+        recompute=True,dragPart=None,rollback=None,coarse=False,
+        dragCluster=None):
     if not objs:
         sels = FreeCADGui.Selection.getSelectionEx('',False)
         if len(sels):
@@ -277,6 +847,39 @@ def _solve(objs=None,recursive=None,reportFailed=False,
     elif not isinstance(objs,(list,tuple)):
         objs = [objs]
 
+    assemblies = _getAssemblies(objs,recursive)
+    if not assemblies:
+        return True
+
+    try:
+        for assembly in assemblies:
+            if recompute:
+                assembly.recompute(True)
+            if not System.isTouched(assembly):
+                logger.debug('skip untouched assembly '
+                    '{}'.format(objName(assembly)))
+                continue
+            cstrs = None
+            if dragCluster and dragCluster.Assembly == assembly:
+                cstrs = dragCluster.Constraints
+            solver = _solveAssembly(assembly,reportFailed,dragPart,
+                    recompute,rollback,coarse,cstrs)
+            # keep the assembly touched if only coarsely or partially solved,
+            # so that it will be refined by the next solve
+            if not solver.coarse and cstrs is None:
+                System.touch(assembly,False)
+    except Exception:
+        if rollback is not None:
+            _rollback(rollback)
+        raise
+
+    return True
+
+def _getAssemblies(objs,recursive):
+    '''
+    Return the enabled assemblies in objs, and their dependent ones if
+    recursive, in the order of solving
+    '''
     assemblies = []
     for obj in objs:
         if not isTypeOf(obj,Assembly):
@@ -289,7 +892,7 @@ def _solve(objs=None,recursive=None,reportFailed=False,
 
     if not assemblies:
         logger.info('no assembly found')
-        return True
+        return assemblies
 
     if recursive:
         # Get all dependent object, including external ones, and return as a
@@ -311,35 +914,21 @@ def _solve(objs=None,recursive=None,reportFailed=False,
 
         if not assemblies:
             raise RuntimeError('no assembly need to be solved')
+    return assemblies
 
-    try:
-        for assembly in assemblies:
-            if recompute:
-                assembly.recompute(True)
-            if not System.isTouched(assembly):
-                logger.debug('skip untouched assembly '
-                    '{}'.format(objName(assembly)))
-                continue
-            Solver(assembly,reportFailed,dragPart,recompute,rollback)
-            System.touch(assembly,False)
-    except Exception:
-        if rollback is not None:
-            for name,part,v in reversed(rollback):
-                logger.debug('roll back {} to {}'.format(name,v))
-                if isinstance(v,FreeCAD.Placement):
-                    setPlacement(part,v)
-                elif utils.isDraftWire(part):
-                    idx,pt = v
-                    part.Points[idx] = pt
-                elif utils.isDraftWire(part):
-                    r,a1,a2 = v
-                    part.Radius = r
-                    part.FirstAngle = a1
-                    part.LastAngle = a2
-
-        raise
-
-    return True
+def _rollback(rollback):
+    for name,part,v in reversed(rollback):
+        logger.debug('roll back {} to {}'.format(name,v))
+        if isinstance(v,FreeCAD.Placement):
+            setPlacement(part,v)
+        elif utils.isDraftWire(part):
+            idx,pt = v
+            part.Points[idx] = pt
+        elif utils.isDraftWire(part):
+            r,a1,a2 = v
+            part.Radius = r
+            part.FirstAngle = a1
+            part.LastAngle = a2
 
 _SolverBusy = False
 
@@ -349,11 +938,295 @@ def solve(*args, **kargs):
         raise RuntimeError("Recursive call of solve() is not allowed")
     try:
         Assembly.cancelAutoSolve();
+        # wait for the background solving, as it may be using the same system
+        cancelAsync(True)
         _SolverBusy = True
         return _solve(*args,**kargs)
     finally:
         _SolverBusy = False
 
+class DragPreview(object):
+    '''
+    First order prediction of the parts moved by dragging. The drag cluster is
+    linearized once at the start, and each motion is then projected onto the
+    null space of the constraint Jacobian instead of being solved.
+    '''
+    # maximum equation residual of a prediction relative to the assembly size,
+    # beyond which the parts shall be solved again
+    Tolerance = 1e-3
+
+    def __init__(self,solver,partInfo,tolerance):
+        self.solver = solver
+        self.params = partInfo.Params
+        self.rotation = partInfo.Placement.Rotation.Q
+        self.tolerance = tolerance
+
+    @classmethod
+    def make(cls,assembly,dragPart,dragCluster=None):
+        '''
+        Linearize the constraints of dragPart in assembly at the current
+        placements. Return None if not supported by the solver backend
+        '''
+        if not getattr(System.getSystem(assembly),'linearize',None):
+            return None
+        # the background solving may be using the same system
+        cancelAsync(True)
+        cstrs = None
+        if dragCluster and dragCluster.Assembly == assembly:
+            cstrs = dragCluster.Constraints
+        solver = Solver(assembly,False,dragPart,False,None,cstrs=cstrs,
+                deferred=True)
+        if not solver.prepared or solver.isFixedPart(dragPart) or \
+           dragPart in solver._closedPlacements:
+            return None
+        partInfo = solver._partMap.get(dragPart,None)
+        if not partInfo or not partInfo.Params:
+            return None
+        if not solver.system.linearize(solver.group):
+            return None
+        scale = solver._scale if solver._scale else 1.0
+        return cls(solver,partInfo,cls.Tolerance*scale)
+
+    def move(self,pla,rollback=None):
+        '''
+        Move the dragged part to pla, and the others accordingly. Return False
+        without moving if the prediction drifts beyond the tolerance
+        '''
+        global _SolverBusy
+        if _SolverBusy:
+            raise RuntimeError("Recursive call of solve() is not allowed")
+        q = pla.Rotation.Q
+        # q and -q are the same rotation, take the one closer to the start
+        if sum(a*b for a,b in zip(q,self.rotation)) < 0:
+            q = [-v for v in q]
+        base = pla.Base
+        residual = self.solver.system.predict(self.params,
+                (base.x,base.y,base.z,q[3],q[0],q[1],q[2]))
+        if residual > self.tolerance:
+            logger.debug('drag preview residual {} exceeds {}'.format(
+                residual,self.tolerance))
+            return False
+        try:
+            Assembly.cancelAutoSolve()
+            _SolverBusy = True
+            self.solver.apply(True,rollback)
+        except Exception:
+            if rollback is not None:
+                _rollback(rollback)
+            raise
+        finally:
+            _SolverBusy = False
+        return True
+
+class _AsyncSolve(object):
+    '''
+    Solve assemblies one after another, with each system solved in a worker
+    thread. The preparation and the applying of the result access the
+    document, and are done in the main thread. So is the logging of the
+    worker, see FCADLogger.flushThreadLog().
+
+    The main thread only stays responsive if the backend does not hold the
+    GIL throughout solving. The SymPy backend runs Python code, which yields
+    it periodically. SolveSpace is called through a SWIG binding, which holds
+    it for the whole call unless built with thread support, so the UI still
+    blocks while solving with it.
+    '''
+    _PollInterval = 20
+
+    def __init__(self,assemblies,transID):
+        self.assemblies = list(assemblies)
+        self.transID = transID
+        self.cancelled = False
+        # job to start once this one finishes
+        self.next = None
+        self.solver = None
+        self.assembly = None
+        self.thread = None
+        self.error = None
+        self.start = 0
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.onTimer)
+
+    def isRunning(self):
+        return self.thread is not None
+
+    def cancel(self,wait=False):
+        'Cancel the solving, and return the assemblies not solved yet'
+        pending = self.assemblies
+        if self.thread and not self.cancelled:
+            pending = [self.assembly] + pending
+        if self.next:
+            pending += self.next.assemblies
+        self.assemblies = []
+        self.cancelled = True
+        self.next = None
+        if wait and self.thread:
+            self.thread.join()
+            self.onTimer()
+        return pending
+
+    def run(self):
+        global _SolverBusy
+        while self.assemblies and not self.cancelled:
+            assembly = self.assemblies.pop(0)
+            _SolverBusy = True
+            try:
+                assembly.recompute(True)
+                if not System.isTouched(assembly):
+                    logger.debug('skip untouched assembly '
+                        '{}'.format(objName(assembly)))
+                    continue
+                self.start = time.time()
+                solver = Solver(assembly,False,None,True,None,deferred=True)
+            except Exception as e:
+                logger.error('solver exception when auto recompute: '
+                        '{}'.format(e))
+                break
+            finally:
+                _SolverBusy = False
+            if not solver.prepared:
+                System.touch(assembly,False)
+                continue
+            self.assembly = assembly
+            self.solver = solver
+            self.error = None
+            self.thread = threading.Thread(target=self.solveSystem)
+            self.thread.daemon = True
+            self.thread.start()
+            self.timer.start(self._PollInterval)
+            return
+        self.finish()
+
+    def solveSystem(self):
+        try:
+            self.solver.solveSystem()
+        except Exception as e:
+            self.error = e
+
+    def onTimer(self):
+        FCADLogger.flushThreadLog()
+        if not self.thread:
+            return
+        if self.thread.is_alive():
+            self.timer.start(self._PollInterval)
+            return
+        self.thread = None
+        if self.cancelled:
+            logger.debug('discard cancelled solving of {}'.format(
+                objName(self.assembly)))
+            self.finish()
+            return
+
+        assembly,solver = self.assembly,self.solver
+        self.solver = None
+        if self.error:
+            # any exception leaves the system state unreliable
+            try:
+                solver.onFailed(self.error)
+            except Exception as e:
+                self.error = e
+        elapsed = time.time()-self.start
+        if self.error:
+            if System.onSolved(assembly,elapsed,True):
+                # try again with another backend
+                self.assemblies.insert(0,assembly)
+            else:
+                logger.error('solver exception when auto recompute: '
+                        '{}'.format(self.error))
+                self.assemblies = []
+            self.run()
+            return
+        System.onSolved(assembly,elapsed)
+        assembly.Proxy.updateSolveTime(elapsed)
+        if self.apply(assembly,solver):
+            self.run()
+        else:
+            self.finish()
+
+    def apply(self,assembly,solver):
+        global _SolverBusy
+        # apply the result in the transaction that triggered the solving if it
+        # is still active
+        trans = self.transID and self.transID==FreeCAD.getActiveTransaction()
+        if not trans:
+            FreeCAD.setActiveTransaction('Assembly auto recompute')
+        rollback = []
+        _SolverBusy = True
+        try:
+            solver.apply(True,rollback)
+            if not solver.coarse:
+                System.touch(assembly,False)
+            ret = True
+        except Exception as e:
+            logger.error('solver exception when auto recompute: '
+                    '{}'.format(e))
+            _rollback(rollback)
+            ret = False
+        finally:
+            _SolverBusy = False
+        if not trans:
+            FreeCAD.closeActiveTransaction(not ret)
+        return ret
+
+    def finish(self):
+        global _AsyncJob
+        self.assemblies = []
+        if _AsyncJob is self:
+            _AsyncJob = self.next
+            if self.next:
+                self.next.run()
+
+_AsyncJob = None
+
+def solveAsync(objs,recursive=True,transID=0):
+    '''
+    Solve the assemblies in background. Any solving already in progress is
+    cancelled, and the new one starts once it stops.
+    '''
+    global _AsyncJob
+    running = _AsyncJob and _AsyncJob.isRunning()
+    if running:
+        # take over the assemblies not yet solved by the cancelled one
+        objs = _AsyncJob.cancel() + list(objs)
+    assemblies = _getAssemblies(objs,recursive)
+    if not assemblies:
+        return
+    # Keep only the last occurrence, so that an assembly is still solved after
+    # its children.
+    seen = set()
+    merged = []
+    for assembly in reversed(assemblies):
+        if assembly not in seen:
+            seen.add(assembly)
+            merged.append(assembly)
+    job = _AsyncSolve(list(reversed(merged)),transID)
+    if running:
+        _AsyncJob.next = job
+    else:
+        _AsyncJob = job
+        job.run()
+
+def cancelAsync(wait=False):
+    '''
+    Cancel the background solving. If wait, block until the worker thread
+    stops, which can not be interrupted in the middle of solving.
+
+    The assemblies not solved yet are handed over to the next auto solve, as
+    they are still touched.
+    '''
+    if not _AsyncJob:
+        return
+    for obj in _AsyncJob.cancel(wait):
+        try:
+            Assembly._AutoSolveSet.add(obj.Proxy)
+        except Exception:
+            # deleted object
+            pass
+
+def isSolvingAsync():
+    return _AsyncJob is not None
+
 def isBusy():
     return _SolverBusy
 
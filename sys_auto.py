@@ -0,0 +1,162 @@
+import math
+from .deps import with_metaclass
+from .system import System, SystemBase
+from .constraint import Constraint
+from .utils import objName
+
+class SystemAuto(with_metaclass(System, SystemBase)):
+    '''
+    Route the solving to the fastest backend that supports all constraints of
+    the assembly, and fall back to the others on failure
+    '''
+    _id = 3
+
+    def __init__(self,obj):
+        super(SystemAuto,self).__init__(obj)
+        # Backends ordered by preference, i.e. the faster one first. Registered
+        # type id happens to follow this order.
+        self._backends = []
+        for tp in sorted(System.getInfo().Types,key=lambda t:t._id):
+            if tp._id > 0 and tp is not SystemAuto:
+                self._backends.append(tp(obj))
+        self._current = None
+        self._tried = set()
+        # (backend id, problem size bucket) -> Stats
+        self._stats = {}
+
+    class Stats(object):
+        __slots__ = ('count','time','failed')
+
+        def __init__(self):
+            self.count = 0
+            self.time = 0.0
+            # number of successful solves by the other backends before this
+            # one is preferred again after a failure
+            self.failed = 0
+
+    # smoothing factor of the averaged solving time
+    _TimeFactor = 0.3
+
+    # see Stats.failed
+    _FailedRetry = 5
+
+    # number of parameters of each part placement
+    _PartParams = 7
+
+    @classmethod
+    def getName(cls):
+        return 'Auto'
+
+    def isDisabled(self,_obj):
+        return not self._backends
+
+    def isConstraintSupported(self,cstrName):
+        for backend in self._backends:
+            if self._isSupported(backend,cstrName):
+                return True
+        return False
+
+    @staticmethod
+    def _isSupported(backend,cstrName):
+        # Same as System.isConstraintSupported(), except that the backend is
+        # asked with the system function the constraint is prepared with, as
+        # a backend may not support a constraint under its type name.
+        if cstrName == 'Locked':
+            return True
+        funcName = Constraint.getFuncName(cstrName)
+        if not funcName:
+            return True
+        return backend.isConstraintSupported(funcName[3:])
+
+    def onDetach(self,obj):
+        for backend in self._backends:
+            callback = getattr(backend,'onDetach',None)
+            if callback:
+                callback(obj)
+
+    def onChanged(self,obj,prop):
+        super(SystemAuto,self).onChanged(obj,prop)
+        for backend in self._backends:
+            backend.onChanged(obj,prop)
+
+    @classmethod
+    def _getSize(cls,obj):
+        '''
+        Return the size bucket of the problem, i.e. the magnitude of its
+        constraint and parameter count, and the constraint type names
+        '''
+        cstrs = obj.Proxy.getConstraints()
+        params = len(obj.Proxy.getConstrainedParts())*cls._PartParams
+        bucket = (int(math.log(len(cstrs)+1,2)),int(math.log(params+1,2)))
+        return bucket,set(Constraint.getTypeName(o) for o in cstrs)
+
+    def _getStats(self,backend,bucket):
+        key = (backend._id,bucket)
+        stats = self._stats.get(key,None)
+        if not stats:
+            stats = self.Stats()
+            self._stats[key] = stats
+        return stats
+
+    def _select(self,obj):
+        bucket,names = self._getSize(obj)
+        candidates = []
+        for i,backend in enumerate(self._backends):
+            if backend._id in self._tried:
+                continue
+            if not all(self._isSupported(backend,n) for n in names):
+                continue
+            stats = self._getStats(backend,bucket)
+            # Prefer backends that did not fail last time. Then the ones with
+            # known solving time of similar sized problems, ordered by that
+            # time, and finally by preference.
+            candidates.append(((stats.failed>0,not stats.count,stats.time,i),
+                               backend))
+        if not candidates:
+            return None
+        backend = min(candidates,key=lambda c:c[0])[1]
+        self.log('{} selects {} for problem size {}'.format(
+            objName(obj),backend.getName(),bucket))
+        return backend
+
+    def getSystem(self,obj,reset=False):
+        backend = self._select(obj)
+        if not backend:
+            raise RuntimeError('no solver backend supports all constraints '
+                'of {}'.format(objName(obj)))
+        self._current = backend
+        return backend.getSystem(obj,reset)
+
+    def onSolved(self,obj,elapsed,failed=False):
+        backend = self._current
+        if not backend:
+            return False
+        bucket,_ = self._getSize(obj)
+        stats = self._getStats(backend,bucket)
+        if failed:
+            stats.failed = self._FailedRetry
+            self.log('{} failed to solve {}'.format(
+                backend.getName(),objName(obj)))
+            self._tried.add(backend._id)
+            if self._select(obj):
+                return True
+            # all backends failed, give them another chance next time
+            for stats in self._stats.values():
+                stats.failed = 0
+        else:
+            stats.failed = 0
+            # let the failure of the other backends wear off
+            for other in self._backends:
+                if other is not backend:
+                    otherStats = self._getStats(other,bucket)
+                    otherStats.failed = max(0,otherStats.failed-1)
+            if not stats.count:
+                stats.time = elapsed
+            else:
+                stats.time += self._TimeFactor*(elapsed-stats.time)
+            stats.count += 1
+            self.log('{} solved {} in {:.3f}s, average {:.3f}s'.format(
+                backend.getName(),objName(obj),elapsed,stats.time))
+        self._tried.clear()
+        self._current = None
+        return False
@@ -16,6 +16,7 @@ class SystemSlvs(with_metaclass(System, SystemBase)):
 
     def __init__(self,obj):
         super(SystemSlvs,self).__init__(obj)
+        self._system = None
 
     @classmethod
     def getName(cls):
@@ -24,14 +25,29 @@ class SystemSlvs(with_metaclass(System, SystemBase)):
     def isDisabled(self,_obj):
         return False
 
-    def getSystem(self,_obj):
-        return _SystemSlvs(self.log)
+    def getSystem(self,_obj,reset=False):
+        # Keep one native system per assembly, and reuse it as long as it
+        # holds a valid solver session
+        system = getattr(self,'_system',None)
+        if reset or not system or not system.session:
+            system = _SystemSlvs(self.log)
+            self._system = system
+        else:
+            system.log = self.log
+        return system
+
+    def onChanged(self,obj,prop):
+        super(SystemSlvs,self).onChanged(obj,prop)
+        if prop in self._props:
+            self._system = None
 
 
 class _SystemSlvs(SystemExtension,slvs.System):
     def __init__(self,log):
         super(_SystemSlvs,self).__init__()
         self.log = log
+        # see solver.SolverSession
+        self.session = None
 
     def solve(self, group=0, reportFailed=False):
         ret = super(_SystemSlvs,self).solve(group,reportFailed)
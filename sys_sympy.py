@@ -7,6 +7,7 @@ from .utils import syslogger as logger, objName
 import sympy as sp
 import sympy.vector as spv
 import scipy.optimize as sopt
+import scipy.linalg as sla
 import numpy as np
 
 class _AlgoType(ProxyType):
@@ -23,13 +24,22 @@ class _AlgoType(ProxyType):
             name = _AlgoPowell.getName()
         super(_AlgoType,mcs).setDefaultTypeID(obj,name)
 
-def _makeProp(name,doc='',tp='App::PropertyFloat',group=None):
+def _makeProp(name,doc='',tp='App::PropertyFloat',group=None,default=None):
     if not group:
         group = _AlgoType._propGroup
-    info = PropertyInfo(_AlgoType,name,tp,doc,duplicate=True,group=group)
+    info = PropertyInfo(_AlgoType,name,tp,doc,duplicate=True,group=group,
+            default=default)
     return info.Key
 
 _makeProp('Tolerance','','App::PropertyPrecision','Solver')
+_makeProp('CoarseTolerance','Tolerance used for the intermediate solving during\n'
+    'interactive dragging. Zero to always use Tolerance',
+    'App::PropertyPrecision','Solver',1e-4)
+_makeProp('MultiStart','Number of perturbed initial values to try in one\n'
+    'batch if the solver fails to converge from the current placement.\n'
+    'Zero to disable','App::PropertyInteger','Solver')
+_makeProp('CheckRedundancy','Detect and remove linearly dependent equations\n'
+    'if the solver fails to converge','App::PropertyBool','Solver',True)
 
 class _AlgoBase(with_metaclass(_AlgoType, object)):
     _id = -2
@@ -61,9 +71,24 @@ class _AlgoBase(with_metaclass(_AlgoType, object)):
         tol = self.Object.Tolerance
         return tol if tol else None
 
+    @property
+    def CoarseTolerance(self):
+        tol = self.Object.CoarseTolerance
+        return tol if tol else None
+
+    @property
+    def MultiStart(self):
+        return self.Object.MultiStart
+
+    @property
+    def CheckRedundancy(self):
+        return self.Object.CheckRedundancy
+
     @classmethod
     def getPropertyInfoList(cls):
-        return ['Tolerance'] + cls._common_options + cls._options
+        return ['Tolerance','CoarseTolerance','MultiStart',
+                'CheckRedundancy'] + \
+                cls._common_options + cls._options
 
 class _AlgoNoJacobian(_AlgoBase):
     NeedJacobian = False
@@ -223,9 +248,9 @@ class SystemSymPy(with_metaclass(System, SystemBase)):
 
     def isConstraintSupported(self,cstrName):
         return _MetaType.isConstraintSupported(cstrName) or \
-                getattr(_SystemSymPy,'add'+cstrName)
+                getattr(_SystemSymPy,'add'+cstrName,None)
 
-    def getSystem(self,obj):
+    def getSystem(self,obj,_reset=False):
         return _SystemSymPy(self,_AlgoType.getProxy(obj))
 
     def isDisabled(self,_obj):
@@ -278,6 +303,7 @@ class _Param(_Base):
     def __init__(self,name,v,g):
         super(_Param,self).__init__(name,g)
         self.val = v
+        self.scale = 1.0
         self._sym = sp.Dummy(self._name,real=True)
         self._symobj = self._sym
         self._val = sp.Float(self.val)
@@ -1050,8 +1076,33 @@ class _EqualRadius(_Constraint):
     def getEq(self):
         return self.c1.Radius - self.c2.Radius
 
-#  class _WhereDragged(_ProjectingConstraint):
-#      _args = ('pt',)
+class _WhereDragged(_ProjectingConstraint):
+    _args = ('pt',)
+
+    # Soft constraint. Instead of an equation to be satisfied, it produces
+    # weighted residuals pulling the point towards its initial position, i.e.
+    # where it is dragged.
+    Soft = True
+    Weight = 1e-2
+
+    def getEqWithParams(self,args):
+        return [ self.Weight*(c - c.subs(args))
+                    for c in _vectorComponent(self.pt.Vector) ]
+
+def _sumFunc(f1,f2):
+    return lambda *args: f1(*args)+f2(*args)
+
+def _addFuncs(funcs1,funcs2):
+    'return the sum of two results of _SystemSymPy.lambdifyEquations()'
+    eq1,jeqs1,heqs1 = funcs1
+    eq2,jeqs2,heqs2 = funcs2
+    jeqs = heqs = None
+    if jeqs1:
+        jeqs = [_sumFunc(f1,f2) for f1,f2 in zip(jeqs1,jeqs2)]
+    if heqs1:
+        heqs = [[_sumFunc(f1,f2) for f1,f2 in zip(r1,r2)]
+                    for r1,r2 in zip(heqs1,heqs2)]
+    return _sumFunc(eq1,eq2),jeqs,heqs
 
 class _SystemSymPy(SystemExtension):
     def __init__(self,parent,algo):
@@ -1060,10 +1111,14 @@ class _SystemSymPy(SystemExtension):
         self.NameTag = '?'
         self.Dof = -1
         self.Failed = []
+        self.Redundant = []
         self.Params = set()
         self.Constraints = set()
         self.Entities = set()
         self.eqs = []
+        self.scale = None
+        self.coarse = False
+        self._linear = None
         self.algo = algo
         self.log = parent.log
         self.verbose = parent.verbose
@@ -1075,18 +1130,280 @@ class _SystemSymPy(SystemExtension):
     def reset(self):
         self.__init__()
 
+    # The minimizer works on the scaled variables y, with x = y*scale. The
+    # derivatives are transformed accordingly.
+
     def F(self,params,eq,jeqs,_heqs):
+        scale = self.scale
+        if scale is not None:
+            params = params*scale
         params = tuple(params)
         res = eq(*params)
         if not jeqs:
             return res
-        return (res,np.array([jeq(*params) for jeq in jeqs]))
+        jac = np.array([jeq(*params) for jeq in jeqs])
+        if scale is not None:
+            jac = jac*scale
+        return (res,jac)
 
     def hessF(self,params,_eqs,_jeqs,heqs):
+        scale = self.scale
+        if scale is not None:
+            params = params*scale
         params = tuple(params)
-        return np.array([[eq(*params) for eq in eqs] for eqs in heqs])
+        hess = np.array([[eq(*params) for eq in eqs] for eqs in heqs])
+        if scale is not None:
+            hess = hess*np.outer(scale,scale)
+        return hess
+
+    EquationInfo = namedtuple('EquationInfo',('Name','Expr','Obj'))
 
-    EquationInfo = namedtuple('EquationInfo',('Name','Expr'))
+    # relative threshold of the rank-revealing QR decomposition
+    _RankTolerance = 1e-10
+
+    # maximum residual of a removed redundant equation
+    _RedundancyTolerance = 1e-6
+
+    # number of best multi-start candidates to refine
+    _MultiStartRefine = 3
+
+    def minimize(self,x0,args,jac,hess):
+        algo = self.algo
+        tol = algo.CoarseTolerance if self.coarse else algo.Tolerance
+        return sopt.minimize(self.F,x0,args,jac=jac,hess=hess,
+            tol=tol,method=algo.getName(),options=algo.Options)
+
+    def multiStart(self,x0,args,jac,hess,count):
+        '''
+        Perturb the initial values into a batch of count starting points, and
+        evaluate their residuals in one vectorized call. Only the best few
+        candidates are refined with the chosen algorithm.
+        '''
+        eq = args[0]
+        x0 = np.array(list(x0),dtype=float)
+        # perturb relative to the magnitude of each parameter, so that the
+        # translation and the quaternion parameters are disturbed alike
+        scale = 0.1*np.maximum(np.abs(x0),1.0)
+        rand = np.random.RandomState(len(x0))
+        starts = x0 + rand.standard_normal((count,len(x0)))*scale
+        xs = starts if self.scale is None else starts*self.scale
+        res = np.zeros(count) + eq(*xs.T)
+        res[np.isnan(res)] = np.inf
+        self.log('multi-start residuals {} ~ {}'.format(res.min(),res.max()))
+        ret = None
+        for i in np.argsort(res)[:self._MultiStartRefine]:
+            if not np.isfinite(res[i]):
+                break
+            ret = self.minimize(starts[i],args,jac,hess)
+            if ret.success:
+                self.log('multi-start success with candidate {}'.format(i))
+                break
+        return ret
+
+    def removeRedundancy(self,eqs,params,x0):
+        '''
+        Detect linearly dependent equations using a rank-revealing QR
+        decomposition of the equation Jacobian at the initial values
+
+        Return a tuple of the independent and the redundant equations
+        '''
+        jexpr = sp.Matrix([eq.Expr for eq in eqs]).jacobian(params)
+        jac = np.array(sp.lambdify(params,jexpr,modules='numpy')(*x0),
+                dtype=float)
+        if not np.all(np.isfinite(jac)):
+            self.log('skip redundancy check with singular jacobian')
+            return eqs,[]
+        # pivoting on the columns of the transposed Jacobian, i.e. the
+        # equations, puts the independent ones first
+        _,r,perm = sla.qr(jac.T,mode='economic',pivoting=True)
+        diag = np.abs(np.diag(r))
+        if not len(diag) or not diag[0]:
+            return eqs,[]
+        rank = np.count_nonzero(diag > diag[0]*self._RankTolerance)
+        if rank == len(eqs):
+            return eqs,[]
+        redundant = [eqs[i] for i in sorted(perm[rank:])]
+        for eq in redundant:
+            self.log('redundant equation {}: {}'.format(eq.Name,eq.Expr))
+        self.log('removed {} redundant equations out of {}'.format(
+            len(redundant),len(eqs)))
+        return [eqs[i] for i in sorted(perm[:rank])],redundant
+
+    def checkEquations(self,eqs,params,x):
+        res = np.array(sp.lambdify(params,[eq.Expr for eq in eqs],
+            modules='numpy')(*x),dtype=float)
+        failed = np.flatnonzero(~(np.abs(res) <= self._RedundancyTolerance))
+        if len(failed):
+            i = failed[0]
+            self.log('equation {} residual {}'.format(eqs[i].Name,res[i]))
+            return False
+        return True
+
+    # Equations of a group linearized at the parameter values X0, see
+    # linearize(). Basis holds the null space of the scaled Jacobian as columns
+    Linearization = namedtuple('Linearization',
+            ('Params','Index','X0','Scale','Basis','Residual'))
+
+    def linearize(self,group=0):
+        '''
+        Linearize the equations of the given group at the current parameter
+        values, for predicting small movements without solving, see predict()
+
+        Return the degrees of freedom left, i.e. the dimension of the null
+        space of the equation Jacobian
+        '''
+        if not group:
+            group = self.GroupHandle
+        self._linear = None
+        params = {}
+        for e in self.Params:
+            e.reset(group)
+            if e.group == group:
+                params[e._sym] = e
+        if not params:
+            self.log('no parameter to linearize')
+            return 0
+        for objs in (self.Constraints,self.Entities):
+            for e in objs:
+                e.reset(group)
+
+        values = dict((x,p.val) for x,p in params.items())
+        exprs = []
+        for objs in (self.Entities,self.Constraints):
+            for o in objs:
+                if o.group != group or getattr(o,'Soft',False):
+                    continue
+                eq = o.getEqWithParams(values)
+                if not eq:
+                    continue
+                for e in eq if isinstance(eq,(list,tuple)) else [eq]:
+                    if e.free_symbols:
+                        exprs.append(e)
+
+        syms = list(params.keys())
+        x0 = np.array([values[x] for x in syms],dtype=float)
+        scale = np.array([params[x].scale for x in syms],dtype=float)
+        if exprs:
+            jexpr = sp.Matrix(exprs).jacobian(syms)
+            jac = np.array(sp.lambdify(syms,jexpr,modules='numpy')(*x0),
+                    dtype=float)*scale
+            if not np.all(np.isfinite(jac)):
+                self.log('cannot linearize with singular jacobian')
+                return 0
+            _,s,vt = sla.svd(jac)
+            rank = 0
+            if len(s) and s[0]:
+                rank = np.count_nonzero(s > s[0]*self._RankTolerance)
+            basis = vt[rank:].T
+            residual = sp.lambdify(syms,exprs,modules='numpy')
+        else:
+            basis = np.eye(len(syms))
+            residual = None
+
+        self._linear = self.Linearization(
+                Params=[params[x] for x in syms],
+                Index=dict((params[x],i) for i,x in enumerate(syms)),
+                X0=x0,Scale=scale,Basis=basis,Residual=residual)
+        self.log('linearized {} equations with {} parameters, dof {}'.format(
+            len(exprs),len(syms),basis.shape[1]))
+        return basis.shape[1]
+
+    def predict(self,handles,values):
+        '''
+        Move the parameters in handles towards the given values within the
+        null space of the linearized equations, and update all the other
+        linearized parameters accordingly
+
+        Return the maximum equation residual at the predicted values
+        '''
+        lin = self._linear
+        if not lin:
+            raise RuntimeError('system not linearized')
+        try:
+            idx = [lin.Index[h] for h in handles]
+        except KeyError:
+            raise RuntimeError('parameter not linearized')
+        x = lin.X0
+        if lin.Basis.shape[1]:
+            delta = (np.array(values,dtype=float)-x[idx])/lin.Scale[idx]
+            step = sla.lstsq(lin.Basis[idx],delta)[0]
+            x = x + lin.Basis.dot(step)*lin.Scale
+        for p,v in zip(lin.Params,x):
+            p.val = v
+        if not lin.Residual:
+            return 0.0
+        res = np.array(lin.Residual(*x),dtype=float)
+        return float(np.max(np.abs(res))) if res.size else 0.0
+
+    def lambdifyEquations(self,eqs,params):
+        '''
+        Return a tuple of the lambdified sum of square of the equations, and
+        its Jacobian and Hessian if required by the algorithm
+        '''
+        algo = self.algo
+
+        # For holding the sum of square of all equations, which is the one we
+        # are trying to minimize
+        f = None
+
+        for eq in eqs:
+            e = eq.Expr**2
+            f = e if f is None else f+e
+
+        eq = sp.lambdify(params,f,modules='numpy')
+
+        self.log('generated {} equations, with {} parameters'.format(
+            len(eqs),len(params)))
+
+        jeqs = None
+        heqs = None
+        if algo.NeedJacobian or algo.NeedHessian:
+            # Jacobian matrix in sympy expressions
+            jexprs = [f.diff(x) for x in params]
+
+            if algo.NeedJacobian:
+                # Lambdified Jacobian matrix
+                jeqs = [sp.lambdify(params,je,modules='numpy') for je in jexprs]
+                self.log('generated jacobian matrix')
+
+            if algo.NeedHessian:
+                # Lambdified Hessian matrix
+                heqs = [[sp.lambdify(params,je.diff(x),modules='numpy')
+                            for x in params] for je in jexprs ]
+                self.log('generated hessian matrix')
+
+        return eq,jeqs,heqs
+
+    def solveEquations(self,funcs,x0,scale):
+        '''
+        Minimize the lambdified functions returned by lambdifyEquations(),
+        or the sum of several of them
+        '''
+        algo = self.algo
+
+        scale = np.array(scale,dtype=float)
+        if np.all(scale==1.0):
+            self.scale = None
+        else:
+            self.scale = scale
+            x0 = np.array(x0)/scale
+            self.log('scaling parameters by {}'.format(scale))
+
+        jac = True if funcs[1] else None
+        hessF = self.hessF if funcs[2] else None
+
+        ret = self.minimize(x0,funcs,jac,hessF)
+        #  ret = sopt.minimize(self.F,x0,(eq,None,None),method=algo.getName())
+        if not ret.success and algo.MultiStart>0:
+            self.log('solver failed: {}, try multi-start'.format(ret.message))
+            mret = self.multiStart(x0,funcs,jac,hessF,algo.MultiStart)
+            if mret:
+                ret = mret
+        if self.scale is not None:
+            # undo the scaling
+            ret.x = ret.x*self.scale
+            self.scale = None
+        return ret
 
     def solve(self, group=0, reportFailed=False):
         _ = reportFailed
@@ -1132,6 +1449,8 @@ class _SystemSymPy(SystemExtension):
                         i=i+1
 
         algo = self.algo
+        if self.coarse and not algo.CoarseTolerance:
+            self.coarse = False
 
         # for params that can be represent by another single param
         param_subs = {}
@@ -1157,6 +1476,7 @@ class _SystemSymPy(SystemExtension):
             self.log('generating equations...')
 
             eqs = []
+            soft = []
             active_params = {}
             for objs in (self.Entities,self.Constraints):
                 for o in objs:
@@ -1172,6 +1492,10 @@ class _SystemSymPy(SystemExtension):
                         if not symbols:
                             self.log('skip equation without free symbol')
                             continue
+                        if getattr(o,'Soft',False):
+                            soft.append(self.EquationInfo(
+                                Name=o.Name,Expr=e,Obj=o))
+                            continue
                         if len(symbols)==1:
                             self.log('single solve')
                             x = symbols.pop()
@@ -1224,7 +1548,8 @@ class _SystemSymPy(SystemExtension):
                                     if x not in active_params:
                                         active_params[x] = params[x]
                             self.log('add equation')
-                            eqs.append(self.EquationInfo(Name=o.Name, Expr=e))
+                            eqs.append(self.EquationInfo(
+                                Name=o.Name,Expr=e,Obj=o))
             if not restart:
                 break
 
@@ -1236,47 +1561,50 @@ class _SystemSymPy(SystemExtension):
             len(params),len(active_params)))
 
         # all parameters to be solved
-        params = active_params.keys()
+        params = list(active_params.keys())
         # initial values
-        x0 = active_params.values()
-
-        # For holding the sum of square of all equations, which is the one we
-        # are trying to minimize
-        f = None
-
-        for eq in eqs:
-            e = eq.Expr**2
-            f = e if f is None else f+e
-
-        eq = sp.lambdify(params,f,modules='numpy')
-
-        self.log('generated {} equations, with {} parameters'.format(
-            len(eqs),len(params)))
-
-        jac = None
-        jeqs = None
-        heqs = None
-        hessF = None
-        if self.algo.NeedJacobian or self.algo.NeedHessian:
-            # Jacobian matrix in sympy expressions
-            jexprs = [f.diff(x) for x in params]
-
-            if self.algo.NeedJacobian:
-                # Lambdified Jacobian matrix
-                jeqs = [sp.lambdify(params,je,modules='numpy') for je in jexprs]
-                self.log('generated jacobian matrix')
-                jac = True
-
-            if self.algo.NeedHessian:
-                # Lambdified Hessian matrix
-                heqs = [[sp.lambdify(params,je.diff(x),modules='numpy')
-                            for x in params] for je in jexprs ]
-                self.log('generated hessian matrix')
-                hessF = self.hessF
+        x0 = list(active_params.values())
+
+        # characteristic magnitude of each parameter
+        scale = [param_table[x].scale for x in params]
+
+        # Soft equations only pull the constrained parameters. Solve them
+        # together with the constraints first, so that the solution is close
+        # to where it is dragged, and then refine with the constraints only.
+        # The soft terms are lambdified separately, so that the constraint
+        # derivatives are only generated once for both passes.
+        funcs = self.lambdifyEquations(eqs,params)
+        soft = [ eq for eq in soft
+                    if eq.Expr.free_symbols.issubset(active_params) ]
+        if soft:
+            ret = self.solveEquations(_addFuncs(funcs,
+                    self.lambdifyEquations(soft,params)),x0,scale)
+            if ret.success:
+                x0 = list(ret.x)
+            else:
+                self.log('failed to solve with soft equations: '
+                         '{}'.format(ret.message))
+
+        ret = self.solveEquations(funcs,x0,scale)
+        redundant = []
+        if not ret.success and algo.CheckRedundancy:
+            # Linearly dependent equations may stop the solver converging. The
+            # check costs a symbolic Jacobian, so is only done on failure.
+            eqs,redundant = self.removeRedundancy(eqs,params,x0)
+            if redundant:
+                self.log('solver failed: {}, retry without redundant '
+                         'equations'.format(ret.message))
+                rret = self.solveEquations(
+                        self.lambdifyEquations(eqs,params),x0,scale)
+                if not rret.success:
+                    redundant = []
+                elif self.checkEquations(redundant,params,rret.x):
+                    ret = rret
+                else:
+                    self.log('redundant equations not satisfied')
+                    redundant = []
+        self.Redundant = [eq.Obj for eq in redundant]
 
-        ret = sopt.minimize(self.F,x0,(eq,jeqs,heqs), jac=jac,hess=hessF,
-            tol=algo.Tolerance,method=algo.getName(),options=algo.Options)
-        #  ret = sopt.minimize(self.F,x0,(eq,None,None),method=algo.getName())
         if ret.success:
             for x,v in zip(params,ret.x):
                 param_table[x].val = v
@@ -1326,6 +1654,10 @@ class _SystemSymPy(SystemExtension):
         self.Entities.add(v)
         return v
 
+    def setParamScale(self, h, scale):
+        'set the characteristic magnitude of a parameter for variable scaling'
+        self.getParam(h).scale = scale
+
     def addParamV(self, val, group=0):
         if not group:
             group = self.GroupHandle
@@ -55,14 +55,24 @@ class System(ProxyType):
             obj.Proxy.onSolverChanged()
 
     @classmethod
-    def getSystem(mcs,obj):
+    def getSystem(mcs,obj,reset=False):
         proxy = mcs.getProxy(obj)
         if proxy:
-            system = proxy.getSystem(obj)
+            system = proxy.getSystem(obj,reset)
             if isinstance(system,SystemExtension):
                 system.relax = obj.AutoRelax
             return system
 
+    @classmethod
+    def onSolved(mcs,obj,elapsed,failed=False):
+        '''
+        Report the solving time of obj. Return True if a failed solve shall be
+        retried, e.g. by another backend
+        '''
+        func = getattr(mcs.getProxy(obj),'onSolved',None)
+        if func:
+            return func(obj,elapsed,failed)
+
     @classmethod
     def isConstraintSupported(mcs,obj,name):
         if name == 'Locked':
@@ -113,6 +123,21 @@ class SystemBase(with_metaclass(System, object)):
             self.log = logger.info if obj.Verbose else logger.debug
 
 
+def _getAxes(n):
+    'return the x, y, z axis of a NormalInfo in its part coordinates'
+    return [ n.rot.multVec(FreeCAD.Vector(*v))
+                for v in ((1,0,0),(0,1,0),(0,0,1)) ]
+
+def _addBasis(basis,v):
+    'add v to a list of orthonormal vectors if it is linearly independent'
+    v = FreeCAD.Vector(v)
+    for b in basis:
+        v = v - b*v.dot(b)
+    if v.Length > 1e-6:
+        v.normalize()
+        basis.append(v)
+
+
 class SystemExtension(object):
     def __init__(self):
         super(SystemExtension,self).__init__()
@@ -122,9 +147,81 @@ class SystemExtension(object):
         self.firstInfo = None
         self.secondInfo = None
         self.relax = False
+        # Relative DOF accounting of part pairs. Map from a pair of parts to
+        # the part whose coordinates are used, and the orthonormal bases of
+        # their constrained translation and rotation.
+        self.dofMap = {}
+        # Map from part to the set of parts rigidly connected to it
+        self.rigidMap = {}
+        # Set of (constraint, frozenset of the two parts) already solved in
+        # closed form, see Solver._findClosedForm()
+        self.solvedPairs = set()
 
     def checkRedundancy(self,obj,firstInfo,secondInfo):
+        '''
+        Called before adding a constraint between two parts. Return False if
+        the constraint shall be skipped, because the parts are already rigidly
+        connected.
+        '''
         self.cstrObj,self.firstInfo,self.secondInfo=obj,firstInfo,secondInfo
+        if (obj,frozenset((firstInfo.Part,secondInfo.Part))) in \
+                self.solvedPairs:
+            self.log('skip solved {} between {} and {}'.format(cstrName(obj),
+                firstInfo.PartName,secondInfo.PartName))
+            return False
+        if not self.relax:
+            return True
+        group = self.rigidMap.get(firstInfo.Part,None)
+        if not group or secondInfo.Part not in group:
+            return True
+        self.reportRedundancy(True)
+        return False
+
+    def addRigidParts(self,parts):
+        'mark the given parts as rigidly connected to each other'
+        group = set()
+        for part in parts:
+            group |= self.rigidMap.get(part,set((part,)))
+        for part in group:
+            self.rigidMap[part] = group
+
+    def addSolvedPair(self,obj,part1,part2):
+        'mark the constraint between the given parts as solved in closed form'
+        self.solvedPairs.add((obj,frozenset((part1,part2))))
+
+    def removeDof(self,normals,trans=(),rot=()):
+        '''
+        Record the relative translation and rotation directions constrained
+        between the current pair of parts, given as the axis indices of any of
+        the element normals. The pair is considered rigidly connected once
+        both are fully constrained.
+        '''
+        first,second = self.firstInfo,self.secondInfo
+        if not first or not second:
+            return
+        key = frozenset((first.Part,second.Part))
+        dof = self.dofMap.get(key,None)
+        if not dof:
+            dof = (first.Part,[],[])
+            self.dofMap[key] = dof
+        # The directions are only comparable in the coordinates of the same
+        # part, so skip the accounting if none of the normals belongs to it.
+        info = first if dof[0] == first.Part else second
+        for n in normals:
+            if isinstance(n,NormalInfo) and n.params is info.Params:
+                break
+        else:
+            return
+        axes = _getAxes(n)
+        for basis,indices in zip(dof[1:],(trans,rot)):
+            for i in indices:
+                if len(basis) < 3:
+                    _addBasis(basis,axes[i])
+        if len(dof[1])==3 and len(dof[2])==3:
+            self.addRigidParts((first.Part,second.Part))
+
+    def removeOrientationDof(self,lockAngle,*normals):
+        self.removeDof(normals,rot=(0,1,2) if lockAngle else (0,1))
 
     def addSketchPlane(self,*args,**kargs):
         _ = kargs
@@ -196,6 +293,9 @@ class SystemExtension(object):
             e = pln2.origin.entity
 
         if not lockAngle and count==2:
+            # translation along the plane is only partially constrained below,
+            # which is not accounted for.
+            #
             # if there is already some other plane coincident constraint set for
             # this pair of parts, we reduce this second constraint to either a
             # points horizontal or vertical constraint, i.e. reduce the
@@ -217,6 +317,8 @@ class SystemExtension(object):
             return h
 
         h.append(self.addPointsCoincident(pln1.origin.entity, e, group=group))
+        self.removeDof((pln1.normal,pln2.normal),trans=(0,1,2))
+        self.removeOrientationDof(lockAngle,pln1.normal,pln2.normal)
 
         return self.setOrientation(h, lockAngle, yaw, pitch, roll,
                                    pln1.normal, pln2.normal, group)
@@ -238,8 +340,13 @@ class SystemExtension(object):
             h.append(self.addPointInPlane(
                 pln2.origin.entity, pln1.entity,group=group))
         if count<=2:
+            # the normals are only parallel if the orientation is set below
+            self.removeDof((pln1.normal,pln2.normal),trans=(2,))
             if count==2 and not lockAngle:
                 self.reportRedundancy()
+            self.removeOrientationDof(lockAngle,pln1.normal,pln2.normal)
+        else:
+            self.removeDof((pln1.normal,),trans=(2,))
             self.setOrientation(h, lockAngle, yaw, pitch, roll,
                                 pln1.normal, pln2.normal, group)
         return h
@@ -258,6 +365,12 @@ class SystemExtension(object):
         if count < 0:
             return
         relax = count==2 and not lockAngle
+        if isinstance(ln1,NormalInfo):
+            if relax:
+                self.removeDof((ln1,),trans=(0,1))
+            else:
+                self.removeDof((ln1,ln2),trans=(0,1))
+                self.removeOrientationDof(lockAngle,ln1,ln2)
         if isinstance(ln2,NormalInfo):
             ln = ln2.ln
             if not relax:
@@ -276,6 +389,7 @@ class SystemExtension(object):
         h = []
         isPlane = isinstance(e1,PlaneInfo),isinstance(e2,PlaneInfo)
         if all(isPlane):
+            self.removeOrientationDof(lockAngle,e1.normal,e2.normal)
             return self.setOrientation(h, lockAngle, yaw, pitch, raw,
                                        e1.normal, e2.normal, group);
         if not any(isPlane):
@@ -537,6 +537,35 @@ def isSamePlacement(pla1,pla2):
     return isSamePos(pla1.Base,pla2.Base) and \
         isSameValue(pla1.Rotation.Q,pla2.Rotation.Q)
 
+def getBoundBox(objs):
+    'Return the bounding box of the shapes of the given objects'
+    bbox = FreeCAD.BoundBox()
+    for obj in objs:
+        shape = Part.getShape(obj)
+        if not shape.isNull():
+            bbox.add(shape.BoundBox)
+    return bbox
+
+_keyDigits = 6
+
+def _roundKey(v):
+    return tuple(round(x,_keyDigits) for x in v)
+
+def getShapeKey(shape):
+    '''
+    Return a hashable key of the geometry of a shape in its own coordinate
+    system. Copies of the same geometry give the same key.
+    '''
+    bbox = shape.BoundBox
+    return (shape.ShapeType,
+            _roundKey((bbox.XMin,bbox.YMin,bbox.ZMin,
+                       bbox.XMax,bbox.YMax,bbox.ZMax)),
+            tuple(_roundKey(v.Point) for v in shape.Vertexes))
+
+def getPlacementKey(pla):
+    'Return a hashable key of a placement'
+    return _roundKey(pla.Base) + _roundKey(pla.Rotation.Q)
+
 def getElementIndex(name,check=None):
     'Return element index (starting with 1), 0 if invalid'
     for i,c in enumerate(reversed(name)):